@@ -2,8 +2,16 @@
 # To get started, simply uncomment the below code or create your own.
 # Deploy with `firebase deploy`
 
-from firebase_functions import db_fn, options
-from firebase_admin import initialize_app, db, messaging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable
+
+from firebase_functions import db_fn, options, params, scheduler_fn
+
+if TYPE_CHECKING:
+    from firebase_admin import messaging
 
 # For cost control, you can set the maximum number of containers that can be
 # running at the same time. This helps mitigate the impact of unexpected
@@ -12,55 +20,228 @@ from firebase_admin import initialize_app, db, messaging
 # parameter in the decorator, e.g. @https_fn.on_request(max_instances=5).
 options.set_global_options(max_instances=10)
 
-initialize_app(
-    options={
-        "databaseURL": "https://monstageenimages-default-rtdb.firebaseio.com/",
-    }
-)
+# Warm instances kept for notify_on_new_message (0 lets it scale down to nothing) and the number of messages one
+# instance handles at once. A concurrency above 1 requires at least 1 CPU, which is the default of the functions.
+_notify_min_instances = params.IntParam("NOTIFY_MIN_INSTANCES", default=0)
+_notify_concurrency = params.IntParam("NOTIFY_CONCURRENCY", default=80)
+
+# The Admin SDK is only initialized by the first invocation which actually reads the database or sends a notification,
+# so the import of this module (the cold start) and the invocations that exit early do not pay for it
+_sdk_lock = threading.Lock()
+_db_module = None
+_messaging_module = None
+
+
+def _initialize_sdk() -> None:
+    global _db_module, _messaging_module
+    with _sdk_lock:
+        if _db_module is not None:
+            return
+
+        import firebase_admin
+        from firebase_admin import db, messaging
+
+        firebase_admin.initialize_app(
+            options={
+                "databaseURL": "https://monstageenimages-default-rtdb.firebaseio.com/",
+            }
+        )
+        _messaging_module = messaging
+        _db_module = db
+
+
+def _db():
+    if _db_module is None:
+        _initialize_sdk()
+    return _db_module
+
+
+def _messaging():
+    if _messaging_module is None:
+        _initialize_sdk()
+    return _messaging_module
+
+
+# When greater than 0, the messages sent to a same receiver within that many seconds are merged in a single
+# notification. The notifications are then buffered in the database and sent by flush_pending_notifications.
+_coalescing_window = params.IntParam("NOTIFICATION_COALESCING_WINDOW_SECONDS", default=0)
+
+
+class _TtlCache:
+    """
+    Small per-instance cache. The entries expire [ttl] seconds after being stored and the least recently used ones are
+    evicted once [max_size] is reached.
+    """
+
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (self._clock() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
 
+# The caches live as long as the function instance, so a burst of messages in a discussion only reads the profiles once
+_display_info_cache = _TtlCache(max_size=1000, ttl=600)
+_fcm_tokens_cache = _TtlCache(max_size=1000, ttl=60)
+_executor = ThreadPoolExecutor(max_workers=8)
 
-def _cleanup_invalid_tokens(tokens: list[str], response: messaging.BatchResponse, receiver_id: str) -> None:
-    ref = db.reference(f"/v0_1_0/users/{receiver_id}/pushNotificationsTokens")
+# Maximum number of tokens FCM accepts in a single multicast message
+_fcm_batch_size = 500
 
+
+def _read(path: str, shallow: bool = False) -> Any:
+    return _db().reference(path).get(shallow=shallow)
+
+
+def _display_info(user_id: str) -> tuple[str, str, str] | None:
+    """Returns the first name, last name and avatar of a user, only reading these fields from the database"""
+    display_info = _display_info_cache.get(user_id)
+    if display_info is not None:
+        return display_info
+
+    fields = ("firstName", "lastName", "avatar")
+    values = _executor.map(lambda field: _read(f"/v0_1_0/users/{user_id}/{field}"), fields)
+    first_name, last_name, avatar = values
+    if not first_name or not last_name or not avatar:
+        return None
+
+    display_info = (first_name, last_name, avatar)
+    _display_info_cache.set(user_id, display_info)
+    return display_info
+
+
+def _fcm_tokens(user_id: str) -> list[str]:
+    fcm_tokens = _fcm_tokens_cache.get(user_id)
+    if fcm_tokens is not None:
+        return fcm_tokens
+
+    fcm_tokens = _normalized_fcm_tokens(_read(f"/v0_1_0/users/{user_id}/pushNotificationsTokens"))
+    _fcm_tokens_cache.set(user_id, fcm_tokens)
+    return fcm_tokens
+
+
+def _normalized_fcm_tokens(fcm_tokens: Any) -> list[str]:
+    # The tokens are stored either as a list or as a map whose keys are the tokens
+    if isinstance(fcm_tokens, dict):
+        return list(fcm_tokens.keys())
+    if isinstance(fcm_tokens, list):
+        return [fcm_token for fcm_token in fcm_tokens if fcm_token]
+    return []
+
+
+def _invalid_tokens(tokens: list[str], response: "messaging.BatchResponse") -> list[str]:
+    invalid_tokens = []
     for idx, resp in enumerate(response.responses):
         if not resp.success:
             error = resp.exception
             if error.code in ("registration-token-not-registered", "invalid-argument"):
-                token = tokens[idx]
+                invalid_tokens.append(tokens[idx])
+    return invalid_tokens
 
-                # Works for both list and map storage
-                ref.child(token).delete()
 
+def _cleanup_invalid_tokens(invalid_tokens: dict[str, list[str]]) -> None:
+    """Removes the invalid tokens of all the receivers at once, [invalid_tokens] maps the receiver id to its tokens"""
+    receiver_ids = [receiver_id for receiver_id, tokens in invalid_tokens.items() if tokens]
+    stored_tokens = _executor.map(
+        lambda receiver_id: _read(f"/v0_1_0/users/{receiver_id}/pushNotificationsTokens"), receiver_ids
+    )
 
-def _send_notification(receiver_id: str, title: str, body: str) -> None:
-    fcm_tokens = db.reference(f"/v0_1_0/users/{receiver_id}/pushNotificationsTokens").get()
-
-    if not fcm_tokens:
+    paths = {}
+    for receiver_id, fcm_tokens in zip(receiver_ids, stored_tokens):
+        invalid = set(invalid_tokens[receiver_id])
+        if isinstance(fcm_tokens, list):
+            # The app stores the tokens as a list, whose keys are indices, so the list is rewritten without them
+            paths[f"{receiver_id}/pushNotificationsTokens"] = [
+                fcm_token for fcm_token in fcm_tokens if fcm_token and fcm_token not in invalid
+            ]
+        elif isinstance(fcm_tokens, dict):
+            # Either a map whose keys are the tokens or a sparse list, which the database returns as a map of indices
+            paths.update(
+                {
+                    f"{receiver_id}/pushNotificationsTokens/{key}": None
+                    for key, value in fcm_tokens.items()
+                    if key in invalid or value in invalid
+                }
+            )
+    if not paths:
         return
+    _db().reference("/v0_1_0/users").update(paths)
 
-    # Normalize tokens to a list
-    if isinstance(fcm_tokens, dict):
-        fcm_tokens = list(fcm_tokens.keys())
-    elif isinstance(fcm_tokens, list):
-        fcm_tokens = fcm_tokens
-    else:
-        return
-    if not fcm_tokens:
-        return
+    # Make sure the next notifications do not use the removed tokens
+    for receiver_id in invalid_tokens:
+        _fcm_tokens_cache.invalidate(receiver_id)
 
-    message = messaging.MulticastMessage(
-        notification=messaging.Notification(title=title, body=body),
-        tokens=fcm_tokens,
-    )
 
-    response = messaging.send_each_for_multicast(message)
+def _send_notifications(
+    notifications: list[tuple[str, str, str]], fcm_tokens: dict[str, list[str]] | None = None
+) -> None:
+    """
+    Sends each (receiver_id, title, body) notification to all the devices of its receiver. The tokens are split in
+    batches of at most [_fcm_batch_size], the batches are sent concurrently and the invalid tokens are then removed in
+    a single update. [fcm_tokens] can provide the tokens already known for some receivers.
+    """
+    fcm_tokens = {} if fcm_tokens is None else dict(fcm_tokens)
+    missing_receiver_ids = list(dict.fromkeys(receiver_id for receiver_id, _, _ in notifications))
+    missing_receiver_ids = [receiver_id for receiver_id in missing_receiver_ids if receiver_id not in fcm_tokens]
+    fcm_tokens.update(zip(missing_receiver_ids, _executor.map(_fcm_tokens, missing_receiver_ids)))
+
+    batches = []
+    for receiver_id, title, body in notifications:
+        receiver_tokens = fcm_tokens[receiver_id]
+        for start in range(0, len(receiver_tokens), _fcm_batch_size):
+            tokens = receiver_tokens[start : start + _fcm_batch_size]
+            message = _messaging().MulticastMessage(
+                notification=_messaging().Notification(title=title, body=body),
+                tokens=tokens,
+            )
+            batches.append((receiver_id, tokens, message))
+    if not batches:
+        return
+
+    responses = _executor.map(lambda batch: _messaging().send_each_for_multicast(batch[2]), batches)
 
     # Optional cleanup of invalid tokens
-    if response.failure_count > 0:
-        _cleanup_invalid_tokens(fcm_tokens, response, receiver_id)
+    invalid_tokens: dict[str, list[str]] = {}
+    for (receiver_id, tokens, _), response in zip(batches, responses):
+        if response.failure_count > 0:
+            invalid_tokens.setdefault(receiver_id, []).extend(_invalid_tokens(tokens, response))
+    _cleanup_invalid_tokens(invalid_tokens)
 
 
-@db_fn.on_value_created(reference="/v0_1_0/answers/{token}/{studentId}/{questionId}/discussion/{responseId}")
+def _send_notification(receiver_id: str, title: str, body: str, fcm_tokens: list[str] | None = None) -> None:
+    _send_notifications(
+        [(receiver_id, title, body)], fcm_tokens=None if fcm_tokens is None else {receiver_id: fcm_tokens}
+    )
+
+
+@db_fn.on_value_created(
+    reference="/v0_1_0/answers/{token}/{studentId}/{questionId}/discussion/{responseId}",
+    min_instances=_notify_min_instances,
+    concurrency=_notify_concurrency,
+)
 def notify_on_new_message(event) -> None:
     """
     Sends a notification when a new discussion message is created
@@ -78,30 +259,196 @@ def notify_on_new_message(event) -> None:
     token = params["token"]
     student_id = params["studentId"]
     question_id = params["questionId"]
+    response_id = params["responseId"]
     if not token or not student_id or not question_id:
         return
+    coalescing = _coalescing_window.value > 0
 
-    # Read the teacher id from parent node
-    teacher_id = db.reference(f"/v0_1_0/answers/{token}/{student_id}/{question_id}/createdById").get()
-    if not teacher_id:
+    # Everything needed to route the notification is read at once
+    routing = _notification_routing(token=token, student_id=student_id)
+    if routing is None:
         return
+    teacher_id = routing["teacherId"]
 
     # Decide notification recipient
     if sender_id == student_id:
+        sender_name = f"{routing['studentName']} ({routing['studentAvatar']})"
+        if coalescing:
+            _buffer_notification(receiver_id=teacher_id, response_id=response_id, sender_name=sender_name)
+            return
+
         receiver_id = teacher_id
-        student: dict = db.reference(f"/v0_1_0/users/{student_id}").get()
-        avatar = student.get("avatar")
-        first_name = student.get("firstName")
-        last_name = student.get("lastName")
-        if not first_name or not last_name or not avatar:
+        body = f"{sender_name} vous a envoyé un message."
+        fcm_tokens = routing.get("teacherFcmTokens", [])
+    else:
+        # The message can only come from the teacher, so the student is the recipient
+        if sender_id != teacher_id:
+            return
+
+        if coalescing:
+            _buffer_notification(receiver_id=student_id, response_id=response_id, sender_name="")
             return
 
-        body_message = f"{first_name} {last_name} ({avatar}) vous a envoyé un message."
-    elif sender_id == teacher_id:
         receiver_id = student_id
-        body_message = "Ton enseignant.e a envoyé un message!"
+        body = "Ton enseignant.e a envoyé un message!"
+        fcm_tokens = routing.get("studentFcmTokens", [])
+
+    _send_notification(receiver_id=receiver_id, title="Nouveau message", body=body, fcm_tokens=fcm_tokens)
+
+
+def _notification_routing(token: str, student_id: str) -> dict | None:
+    """
+    Reads the routing node of a student in a class, which holds the teacher id, the display name and avatar of the
+    student and the FCM tokens of both. A node missing or incomplete (e.g. created before the triggers were deployed)
+    is rebuilt from the users. Returns None if the class has no teacher or the student has no profile.
+    """
+    routing = _read(f"/v0_1_0/notificationRouting/{token}/{student_id}")
+    if isinstance(routing, dict) and all(key in routing for key in ("teacherId", "studentName", "studentAvatar")):
+        return routing
+    return _build_notification_routing(token=token, student_id=student_id)
+
+
+def _build_notification_routing(token: str, student_id: str) -> dict | None:
+    teacher_id_future = _executor.submit(_read, f"/v0_1_0/tokens/{token}/metadata/createdBy")
+    student_fcm_tokens_future = _executor.submit(_fcm_tokens, student_id)
+    display_info = _display_info(student_id)
+    teacher_id = teacher_id_future.result()
+    if not teacher_id or display_info is None:
+        return None
+
+    first_name, last_name, avatar = display_info
+    routing = {
+        "teacherId": teacher_id,
+        "studentName": f"{first_name} {last_name}",
+        "studentAvatar": avatar,
+        "studentFcmTokens": student_fcm_tokens_future.result(),
+        "teacherFcmTokens": _fcm_tokens(teacher_id),
+    }
+    _db().reference(f"/v0_1_0/notificationRouting/{token}/{student_id}").set(routing)
+    return routing
+
+
+@db_fn.on_value_written(reference="/v0_1_0/tokens/{token}/connectedUsers/{studentId}")
+def update_routing_on_connection(event) -> None:
+    """
+    Creates the notification routing node of a student when they join a class and removes it when they leave.
+    """
+    token = event.params["token"]
+    student_id = event.params["studentId"]
+    if event.data.after is None:
+        _db().reference(f"/v0_1_0/notificationRouting/{token}/{student_id}").delete()
     else:
+        _build_notification_routing(token=token, student_id=student_id)
+
+
+@db_fn.on_value_written(reference="/v0_1_0/users/{userId}")
+def update_routing_on_user_change(event) -> None:
+    """
+    Copies the name, avatar and FCM tokens of a user to the notification routing nodes which hold them: the nodes of
+    the classes a student is connected to, and the nodes of all the students of the classes a teacher created.
+    """
+    user_id = event.params["userId"]
+    before = event.data.before if isinstance(event.data.before, dict) else {}
+    after = event.data.after if isinstance(event.data.after, dict) else {}
+    if not after:
+        # The routing nodes are removed with the connections of the deleted user
+        return
+
+    fields = ("firstName", "lastName", "avatar", "pushNotificationsTokens")
+    if all(before.get(field) == after.get(field) for field in fields):
+        return
+    fcm_tokens = _normalized_fcm_tokens(after.get("pushNotificationsTokens"))
+
+    user_tokens = after.get("tokens") if isinstance(after.get("tokens"), dict) else {}
+    paths = {}
+    for token in user_tokens.get("connected") or {}:
+        if after.get("firstName") and after.get("lastName") and after.get("avatar"):
+            paths[f"{token}/{user_id}/studentName"] = f"{after['firstName']} {after['lastName']}"
+            paths[f"{token}/{user_id}/studentAvatar"] = after["avatar"]
+        paths[f"{token}/{user_id}/studentFcmTokens"] = fcm_tokens
+
+    if before.get("pushNotificationsTokens") != after.get("pushNotificationsTokens"):
+        created_tokens = list(user_tokens.get("created") or {})
+        connected_users = _executor.map(
+            lambda token: _read(f"/v0_1_0/tokens/{token}/connectedUsers", shallow=True), created_tokens
+        )
+        for token, student_ids in zip(created_tokens, connected_users):
+            for student_id in student_ids or {}:
+                paths[f"{token}/{student_id}/teacherFcmTokens"] = fcm_tokens
+
+    if paths:
+        _db().reference("/v0_1_0/notificationRouting").update(paths)
+
+
+@scheduler_fn.on_schedule(schedule="every 1 minutes")
+def flush_pending_notifications(event) -> None:
+    """
+    Sends the notifications buffered by notify_on_new_message when coalescing is enabled.
+    """
+    # The schedule is declared at import time and cannot depend on a param, so it is deployed even without coalescing.
+    # Each run then exits before any database read, which leaves the cost of the invocations themselves: about 1440 a
+    # day, a cold start each time once the instance is scaled down. Pausing the Cloud Scheduler job removes it while
+    # coalescing is off. The notifications still buffered when coalescing is turned off are sent once it is turned on
+    # again.
+    if _coalescing_window.value <= 0:
+        return
+    _flush_pending_notifications(now=time.time(), window=_coalescing_window.value)
+
+
+def _buffer_notification(receiver_id: str, response_id: str, sender_name: str) -> None:
+    # [sender_name] is empty when the sender is the teacher
+    _db().reference(f"/v0_1_0/pendingNotifications/{receiver_id}/{response_id}").set(
+        {"senderName": sender_name, "createdAt": time.time()}
+    )
+
+
+def _flush_pending_notifications(now: float, window: float) -> None:
+    pending = _read("/v0_1_0/pendingNotifications")
+    if not pending:
         return
 
-    # Send notification
-    _send_notification(receiver_id=receiver_id, title="Nouveau message", body=body_message)
+    notifications = []
+    flushed_paths = {}
+    for receiver_id, body, paths in _coalesce_notifications(pending=pending, now=now, window=window):
+        notifications.append((receiver_id, "Nouveau message", body))
+        flushed_paths.update({path: None for path in paths})
+    _send_notifications(notifications)
+
+    # Only remove what was sent, the messages received in the meantime are kept for the next flush
+    if flushed_paths:
+        _db().reference("/v0_1_0/pendingNotifications").update(flushed_paths)
+
+
+def _coalesce_notifications(pending: dict, now: float, window: float) -> list[tuple[str, str, list[str]]]:
+    """
+    Merges the pending notifications of each receiver whose oldest pending message is at least [window] seconds old.
+    Returns the receiver id, the body of the merged notification and the paths (relative to pendingNotifications) of
+    the pending notifications it replaces.
+    """
+    notifications = []
+    for receiver_id, messages in pending.items():
+        if not isinstance(messages, dict) or not messages:
+            continue
+        if now - min(message.get("createdAt", 0) for message in messages.values()) < window:
+            continue
+
+        sender_names = {message.get("senderName", "") for message in messages.values()}
+        count = len(messages)
+        if sender_names == {""}:
+            body = (
+                "Ton enseignant.e a envoyé un message!"
+                if count == 1
+                else f"Ton enseignant.e a envoyé {count} messages!"
+            )
+        elif len(sender_names) == 1:
+            sender_name = next(iter(sender_names))
+            body = (
+                f"{sender_name} vous a envoyé un message."
+                if count == 1
+                else f"{sender_name} vous a envoyé {count} messages."
+            )
+        else:
+            body = f"{count} nouveaux messages de {len(sender_names)} élèves."
+
+        notifications.append((receiver_id, body, [f"{receiver_id}/{response_id}" for response_id in messages]))
+    return notifications
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+import os
+from pathlib import Path
+
+from firebase_controller import FirebaseController, instrumented_script
+
+_epoch = datetime(1970, 1, 1)
+
+
+def main():
+    """
+    Archives the classes without any activity since ARCHIVE_CUTOFF (an ISO date, e.g. 2024-07-01), or restores the
+    classes listed in RESTORE_TOKENS (e.g. "ABC123,DEF456") when it is set.
+    """
+    dry_run = os.getenv("DRY_RUN", "true").lower() == "true"
+    restore_tokens = [token.strip() for token in os.getenv("RESTORE_TOKENS", "").split(",") if token.strip()]
+    cutoff = os.getenv("ARCHIVE_CUTOFF", "")
+    if not restore_tokens and not cutoff:
+        print("Set ARCHIVE_CUTOFF to archive the classes or RESTORE_TOKENS to restore some, cancelling.")
+        return
+
+    if not dry_run:
+        action = (
+            f"restore {len(restore_tokens)} classes" if restore_tokens else f"archive the classes idle since {cutoff}"
+        )
+        confirm = input(f"Are you sure you want to {action}? (y/[n]) ")
+        if confirm.lower() != "y":
+            print("Archiving cancelled.")
+            return
+
+    save_folder = Path(__file__).parent / "export"
+    with instrumented_script("archive_classes", report_folder=save_folder / "reports"):
+        # The archived classes must be up to date, so the database is always downloaded again
+        controller = FirebaseController(
+            certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
+            temporary_folder=save_folder,
+            force_refresh=not restore_tokens,
+            use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
+            incremental_refresh=os.getenv("INCREMENTAL_DATABASE_FETCHING", "false").lower() == "true",
+        )
+        if restore_tokens:
+            controller.restore_tokens(tokens=restore_tokens, dry_run=dry_run)
+        else:
+            # In the local time of this computer unless the date has an offset, like the dates of database_to_excel
+            cutoff_date = datetime.fromisoformat(cutoff).astimezone(timezone.utc).replace(tzinfo=None)
+            cutoff_timestamp = (cutoff_date - _epoch) // timedelta(microseconds=1)
+            controller.archive_tokens(cutoff=cutoff_timestamp, dry_run=dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from datetime import timedelta
+import json
+import os
+from pathlib import Path
+
+from firebase_controller import FirebaseController, instrumented_script
+
+
+def main():
+    dry_run = os.getenv("DRY_RUN", "true").lower() == "true"
+    grace_period = timedelta(days=float(os.getenv("GC_GRACE_PERIOD_DAYS", "7")))
+    max_deletes_per_second = float(os.getenv("GC_MAX_DELETES_PER_SECOND", "50"))
+    if not dry_run:
+        confirm = input(
+            "Are you sure you want to delete the storage files no discussion refers to? This action cannot be undone. "
+            "(y/[n]) "
+        )
+        if confirm.lower() != "y":
+            print("Storage garbage collection cancelled.")
+            return
+
+    save_folder = Path(__file__).parent / "export"
+    with instrumented_script("collect_storage_garbage", report_folder=save_folder / "reports"):
+        # The references must be up to date, a stale database would make the recent photos look orphaned
+        controller = FirebaseController(
+            certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
+            temporary_folder=save_folder,
+            force_refresh=True,
+            use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
+            incremental_refresh=os.getenv("INCREMENTAL_DATABASE_FETCHING", "false").lower() == "true",
+        )
+        report = controller.collect_storage_garbage(
+            grace_period=grace_period, dry_run=dry_run, max_deletes_per_second=max_deletes_per_second
+        )
+
+    print(
+        f"{report['scanned']} storage files were scanned: {report['referenced']} are referenced, {report['recent']} "
+        f"are younger than {grace_period.days} days and {report['not_photos']} are not photos of a discussion"
+    )
+    orphan_megabytes = report["orphan_bytes"] / 1024 / 1024
+    if dry_run:
+        print(f"{len(report['orphans'])} orphans ({orphan_megabytes:.1f} MB) would be deleted")
+    else:
+        print(f"{report['deleted']} out of {len(report['orphans'])} orphans ({orphan_megabytes:.1f} MB) were deleted")
+    if report["failures"]:
+        print(f"{len(report['failures'])} orphans could not be deleted (e.g. {report['failures'][0]})")
+
+    report_filepath = save_folder / "reports" / "storage_garbage.json"
+    report_filepath.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_filepath, "w", encoding="utf-8") as f:
+        json.dump({"dry_run": dry_run, "grace_period_days": grace_period.days, **report}, f, indent=2)
+    print(f"The list of the orphans was saved to {report_filepath}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,328 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import math
 import os
 from pathlib import Path
+from typing import Iterator
+
 import pandas as pd
 
-from firebase_controller import FirebaseController
+from firebase_controller import (
+    FirebaseController,
+    PhotoBundleWriter,
+    export_writer,
+    instrumentation,
+    instrumented_script,
+)
 
+_title_timestamp = "Timestamp"
+_title_id_student = "Id élève"
+_title_id_teacher = "Id enseignant\u00b7e"
+_title_first_name_teacher = "Prénom enseignant\u00b7e"
+_title_last_name_teacher = "Nom enseignant\u00b7e"
+_title_id_question = "Id question"
+_title_metier = "MÉTIER"
+_title_id_answer = "Id réponse"
+_title_content_type = "Question/Répondant"
+_title_content_text = "Text"
 
-def main():
-    save_folder = Path(__file__).parent / "export"
-    controller = FirebaseController(
-        certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
-        temporary_folder=save_folder,
-        force_refresh=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true",
-        use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
-    )
-    controller.download_storage(force_download=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true")
+_columns = [
+    _title_timestamp,
+    _title_id_student,
+    _title_id_teacher,
+    _title_first_name_teacher,
+    _title_last_name_teacher,
+    _title_id_question,
+    _title_metier,
+    _title_id_answer,
+    _title_content_type,
+    _title_content_text,
+]
+_sort_columns = [
+    _title_last_name_teacher,
+    _title_first_name_teacher,
+    _title_id_student,
+    _title_id_question,
+    _title_timestamp,
+    _title_id_answer,
+]
+_epoch = datetime(1970, 1, 1)
 
-    title_timestamp = "Timestamp"
-    title_id_student = "Id élève"
-    title_id_teacher = "Id enseignant\u00b7e"
-    title_first_name_teacher = "Prénom enseignant\u00b7e"
-    title_last_name_teacher = "Nom enseignant\u00b7e"
-    title_id_question = "Id question"
-    title_metier = "MÉTIER"
-    title_id_answer = "Id réponse"
-    title_content_type = "Question/Répondant"
-    title_content_text = "Text"
-
-    output = pd.DataFrame(
-        columns=[
-            title_timestamp,
-            title_id_student,
-            title_id_teacher,
-            title_first_name_teacher,
-            title_last_name_teacher,
-            title_id_question,
-            title_metier,
-            title_id_answer,
-            title_content_type,
-            title_content_text,
-        ]
-    )
 
-    for teaching_token in controller.teaching_tokens:
-        teacher_id = controller.teacher_id(teaching_token=teaching_token)
-        if teacher_id is None:
-            continue
-        teacher = controller.user(user_id=teacher_id)
+def _class_rows(controller: FirebaseController, teaching_token: str, photo_flags: bool = False) -> Iterator[list]:
+    """
+    Yields one record per question and per discussion message of a class. The timestamps are kept as raw
+    microseconds (None for the question rows) so they can be converted all at once. With [photo_flags], each record
+    ends with the isPhotoUrl flag of its message (False for the question rows).
+    """
+    teacher_id = controller.teacher_id(teaching_token=teaching_token)
+    if teacher_id is None:
+        return
+    teacher = controller.user(user_id=teacher_id)
+
+    student_ids = controller.student_ids(teaching_token=teaching_token)
+    for student_id in student_ids:
+        student = controller.user(user_id=student_id)
+        tokens = list(student["tokens"]["connected"].keys())
+        if len(tokens) != 1:
+            raise NotImplementedError("Connected to more than one tokens is not supported yet")
+        token = tokens[0]
+
+        teacher_first_name = teacher["firstName"]
+        teacher_last_name = teacher["lastName"]
 
-        student_ids = controller.student_ids(teaching_token=teaching_token)
-        for student_id in student_ids:
-            student = controller.user(user_id=student_id)
-            tokens = list(student["tokens"]["connected"].keys())
-            if len(tokens) != 1:
-                raise NotImplementedError("Connected to more than one tokens is not supported yet")
-            token = tokens[0]
-
-            teacher_first_name = teacher["firstName"]
-            teacher_last_name = teacher["lastName"]
-
-            student_answers = controller.answers(teaching_token=token, student_id=student_id)
-            for question_id in student_answers:
-                question = controller.question(teacher_id=teacher_id, question_id=question_id)
-                if question is None:
-                    continue
-
-                metier = "MÉTIER"[question["section"]]
-                output.loc[len(output)] = [
-                    "",
+        student_answers = controller.answers(teaching_token=token, student_id=student_id)
+        for question_id in student_answers:
+            question = controller.question(teacher_id=teacher_id, question_id=question_id)
+            if question is None:
+                continue
+
+            metier = "MÉTIER"[question["section"]]
+            question_row = [
+                None,
+                student_id,
+                teacher_id,
+                teacher_first_name,
+                teacher_last_name,
+                question_id,
+                metier,
+                "",
+                "Question",
+                question["text"],
+            ]
+            if photo_flags:
+                question_row.append(False)
+            yield question_row
+
+            if "discussion" not in student_answers[question_id]:
+                continue
+
+            for discussion_id, tp in student_answers[question_id]["discussion"].items():
+                message_row = [
+                    tp["creationTimeStamp"],
                     student_id,
                     teacher_id,
                     teacher_first_name,
                     teacher_last_name,
                     question_id,
                     metier,
-                    "",
-                    "Question",
-                    question["text"],
+                    discussion_id,
+                    "student" if tp["creatorId"] == student_id else "teacher",
+                    tp["text"],
                 ]
+                if photo_flags:
+                    message_row.append(bool(tp.get("isPhotoUrl")))
+                yield message_row
+
+
+def collect_rows(controller: FirebaseController) -> list[list]:
+    return [row for teaching_token in controller.teaching_tokens for row in _class_rows(controller, teaching_token)]
+
+
+def collect_rows_in_parallel(controller: FirebaseController, temporary_folder: Path, workers: int) -> list[list]:
+    """
+    Same rows as collect_rows, with the teaching tokens sharded across a pool of [workers] processes. Each worker
+    opens the snapshot saved in [temporary_folder] on its own and the shards are concatenated back in the token
+    order, so sorting the result gives exactly the same table as the serial run.
+    """
+    teaching_tokens = controller.teaching_tokens
+    shard_size = max(1, math.ceil(len(teaching_tokens) / (workers * 4)))
+    shards = [teaching_tokens[start : start + shard_size] for start in range(0, len(teaching_tokens), shard_size)]
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_initialize_worker, initargs=(temporary_folder,)
+    ) as executor:
+        return [row for shard_rows in executor.map(_collect_shard_rows, shards) for row in shard_rows]
+
+
+_worker_controller: FirebaseController = None
+
+
+def _initialize_worker(temporary_folder: Path) -> None:
+    global _worker_controller
+    _worker_controller = FirebaseController.from_snapshot(temporary_folder=temporary_folder)
+
+
+def _collect_shard_rows(teaching_tokens: tuple[str]) -> list[list]:
+    return [row for teaching_token in teaching_tokens for row in _class_rows(_worker_controller, teaching_token)]
+
+
+def iterate_sorted_rows(controller: FirebaseController, photo_flags: bool = False) -> Iterator[list]:
+    """
+    Yields the same rows as build_table, already formatted and in the same order, without ever holding more than the
+    classes of one teacher in memory. [photo_flags] is passed to _class_rows.
+    """
+    tokens_by_teacher_name: dict[tuple[str, str], list[str]] = {}
+    for teaching_token in controller.teaching_tokens:
+        teacher_id = controller.teacher_id(teaching_token=teaching_token)
+        if teacher_id is None:
+            continue
+        teacher = controller.user(user_id=teacher_id)
+        tokens_by_teacher_name.setdefault((teacher["lastName"], teacher["firstName"]), []).append(teaching_token)
+
+    for teacher_name in sorted(tokens_by_teacher_name):
+        rows_by_question: dict[tuple[str, str], list[list]] = {}
+        for teaching_token in tokens_by_teacher_name[teacher_name]:
+            for row in _class_rows(controller, teaching_token, photo_flags=photo_flags):
+                rows_by_question.setdefault((row[1], row[5]), []).append(row)
+
+        for student_and_question in sorted(rows_by_question):
+            # Sorted on the raw timestamps, the question row (without timestamp) first
+            for row in sorted(rows_by_question[student_and_question], key=_row_order):
+                row[0] = "" if row[0] is None else f"{_epoch + timedelta(microseconds=row[0]):%Y-%m-%d %H:%M:%S}"
+                yield row
+
+
+def _row_order(row: list) -> tuple:
+    return row[0] is not None, row[0] or 0, row[7]
+
 
-                if "discussion" not in student_answers[question_id]:
-                    continue
-
-                for discussion_id in student_answers[question_id]["discussion"]:
-                    tp = student_answers[question_id]["discussion"][discussion_id]
-                    time_stamp = pd.to_datetime(tp["creationTimeStamp"], unit="us").strftime("%Y-%m-%d %H:%M:%S")
-                    if not time_stamp:
-                        print("Ccouou")
-                    author = "student" if tp["creatorId"] == student_id else "teacher"
-                    content = tp["text"]
-
-                    output.loc[len(output)] = [
-                        time_stamp,
-                        student_id,
-                        teacher_id,
-                        teacher_first_name,
-                        teacher_last_name,
-                        question_id,
-                        metier,
-                        discussion_id,
-                        author,
-                        content,
-                    ]
-
-    # Sort and save the output
-    output = output.sort_values(
-        by=[title_last_name_teacher, title_first_name_teacher, title_id_student, title_id_question, title_timestamp]
+_discussion_query = """
+    SELECT NULL AS creation_timestamp, answers.student_id, tokens.teacher_id, teachers.first_name,
+        teachers.last_name, answers.question_id, questions.section, '' AS message_id, 'Question' AS author,
+        questions.text, 0 AS is_photo_url
+    FROM tokens
+    JOIN users AS teachers ON teachers.id = tokens.teacher_id
+    JOIN memberships ON memberships.token = tokens.token
+    JOIN answers ON answers.token = memberships.token AND answers.student_id = memberships.user_id
+    JOIN questions ON questions.teacher_id = tokens.teacher_id AND questions.question_id = answers.question_id
+    UNION ALL
+    SELECT messages.creation_timestamp, answers.student_id, tokens.teacher_id, teachers.first_name,
+        teachers.last_name, answers.question_id, questions.section, messages.message_id,
+        CASE WHEN messages.creator_id = messages.student_id THEN 'student' ELSE 'teacher' END, messages.text,
+        messages.is_photo_url
+    FROM tokens
+    JOIN users AS teachers ON teachers.id = tokens.teacher_id
+    JOIN memberships ON memberships.token = tokens.token
+    JOIN answers ON answers.token = memberships.token AND answers.student_id = memberships.user_id
+    JOIN questions ON questions.teacher_id = tokens.teacher_id AND questions.question_id = answers.question_id
+    JOIN messages ON messages.token = answers.token AND messages.student_id = answers.student_id
+        AND messages.question_id = answers.question_id
+    ORDER BY teachers.last_name, teachers.first_name, answers.student_id, answers.question_id, creation_timestamp,
+        message_id
+"""
+
+
+def query_sorted_rows(controller: FirebaseController, photo_flags: bool = False) -> Iterator[list]:
+    """
+    Same rows as iterate_sorted_rows, produced by a single query on the query engine. The answers are looked up in
+    the teaching token the student is a member of.
+    """
+    for row in controller.query_engine.query(_discussion_query):
+        row = list(row)
+        is_photo = bool(row.pop())
+        if photo_flags:
+            row.append(is_photo)
+        row[0] = "" if row[0] is None else f"{_epoch + timedelta(microseconds=row[0]):%Y-%m-%d %H:%M:%S}"
+        row[6] = "MÉTIER"[row[6]]
+        yield row
+
+
+def build_table(rows: list[list]) -> pd.DataFrame:
+    output = pd.DataFrame.from_records(rows, columns=_columns)
+
+    # Sorted on the raw timestamps like the other modes, so the messages sent within a same second keep their order.
+    # The question rows have no timestamp, they come first and are left empty
+    output = output.sort_values(by=_sort_columns, na_position="first")
+
+    # Convert all the timestamps in one pass
+    output[_title_timestamp] = (
+        pd.to_datetime(output[_title_timestamp], unit="us").dt.strftime("%Y-%m-%d %H:%M:%S").fillna("")
     )
-    output.to_excel(save_folder / "output.xlsx", index=False)
+    return output
+
+
+def _timestamp_from_env(name: str) -> int | None:
+    """
+    Reads an ISO date (e.g. 2024-09-01 or 2024-09-01T08:00) in microseconds since the epoch. A date is in the local time
+    of this computer unless it has an offset (e.g. 2024-09-01T00:00-04:00).
+    """
+    value = os.getenv(name, "")
+    if not value:
+        return None
+    utc_date = datetime.fromisoformat(value).astimezone(timezone.utc).replace(tzinfo=None)
+    return (utc_date - _epoch) // timedelta(microseconds=1)
+
+
+def _list_from_env(name: str) -> list[str] | None:
+    values = [value.strip() for value in os.getenv(name, "").split(",") if value.strip()]
+    return values or None
+
+
+def main():
+    save_folder = Path(__file__).parent / "export"
+    with instrumented_script("database_to_excel", report_folder=save_folder / "reports"):
+        _export(save_folder)
+
+
+def _export(save_folder: Path) -> None:
+    controller = FirebaseController(
+        certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
+        temporary_folder=save_folder,
+        force_refresh=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true",
+        use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
+        incremental_refresh=os.getenv("INCREMENTAL_DATABASE_FETCHING", "false").lower() == "true",
+    )
+    controller.download_storage(force_download=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true")
+
+    # Only download the messages of [EXPORT_START, EXPORT_END[ and of the requested teachers and classes
+    export_filters = {
+        "start": _timestamp_from_env("EXPORT_START"),
+        "end": _timestamp_from_env("EXPORT_END"),
+        "teacher_ids": _list_from_env("EXPORT_TEACHER_IDS"),
+        "tokens": _list_from_env("EXPORT_TOKENS"),
+    }
+    is_filtered = any(value is not None for value in export_filters.values())
+    if is_filtered:
+        controller.load_database_slice(**export_filters)
+
+    # Export the classes moved to the storage by archive_classes.py along with the live ones
+    include_archives = os.getenv("EXPORT_INCLUDE_ARCHIVES", "false").lower() == "true"
+    if include_archives:
+        controller.load_archives()
+
+    # The query engine and the workers read the full snapshot on disk, the slice and the archives only live in memory
+    in_memory_only = is_filtered or include_archives
+    use_query_engine = os.getenv("USE_QUERY_ENGINE", "false").lower() == "true" and not in_memory_only
+    export_bundle = os.getenv("EXPORT_BUNDLE", "false").lower() == "true"
+    if use_query_engine or export_bundle or os.getenv("EXPORT_STREAMING", "false").lower() == "true":
+        # Write the rows as they are produced, in the final order
+        # The bundle needs the isPhotoUrl flag of each message to find its photos
+        rows_function = query_sorted_rows if use_query_engine else iterate_sorted_rows
+        rows = rows_function(controller, photo_flags=export_bundle)
+        export_format = os.getenv("EXPORT_FORMAT", "xlsx").lower()
+        if export_bundle:
+            # Zip the table with a thumbnail of each photo posted in the discussions
+            writer = PhotoBundleWriter(
+                save_folder / "output.zip",
+                columns=_columns,
+                storage_folder=save_folder / "storage",
+                photo_column=_columns.index(_title_content_text),
+                sheet_format=export_format,
+                thumbnail_size=int(os.getenv("THUMBNAIL_SIZE", "512")),
+                thumbnail_format=os.getenv("THUMBNAIL_FORMAT", "jpeg").lower(),
+                workers=int(os.getenv("THUMBNAIL_WORKERS", "0")) or None,
+            )
+        else:
+            writer = export_writer(save_folder / f"output.{export_format}", columns=_columns)
+        with instrumentation.phase("write_rows"):
+            with writer:
+                for row in rows:
+                    writer.write_row(row)
+                    instrumentation.count("export.rows")
+    else:
+        # Sort and save the output
+        workers = int(os.getenv("EXPORT_WORKERS", "1"))
+        with instrumentation.phase("collect_rows"):
+            if workers > 1 and not in_memory_only:
+                rows = collect_rows_in_parallel(controller, temporary_folder=save_folder, workers=workers)
+            else:
+                rows = collect_rows(controller)
+        instrumentation.count("export.rows", len(rows))
+        with instrumentation.phase("build_table"):
+            output = build_table(rows)
+        with instrumentation.phase("write_excel"):
+            output.to_excel(save_folder / "output.xlsx", index=False)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,7 @@
 import os
 from pathlib import Path
 
-from firebase_controller import FirebaseController
+from firebase_controller import FirebaseController, instrumented_script
 
 
 def main():
@@ -10,20 +10,24 @@ def main():
         print("No user id provided, cancelling.")
         return
 
-    confirm = input(
-        f"Are you sure you want to delete the user with id {user_id}? This action cannot be undone. (y/[n]) "
-    )
-    if confirm.lower() != "y":
-        print("User deletion cancelled.")
-        return
+    dry_run = os.getenv("DRY_RUN", "false").lower() == "true"
+    if not dry_run:
+        confirm = input(
+            f"Are you sure you want to delete the user with id {user_id}? This action cannot be undone. (y/[n]) "
+        )
+        if confirm.lower() != "y":
+            print("User deletion cancelled.")
+            return
 
-    controller = FirebaseController(
-        certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
-        temporary_folder=Path(__file__).parent / "export",
-        force_refresh=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true",
-        use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
-    )
-    controller.delete_user(user_id=user_id)
+    with instrumented_script("delete_user", report_folder=Path(__file__).parent / "export" / "reports"):
+        controller = FirebaseController(
+            certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
+            temporary_folder=Path(__file__).parent / "export",
+            force_refresh=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true",
+            use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
+            incremental_refresh=os.getenv("INCREMENTAL_DATABASE_FETCHING", "false").lower() == "true",
+        )
+        controller.delete_user(user_id=user_id, dry_run=dry_run)
 
 
 if __name__ == "__main__":
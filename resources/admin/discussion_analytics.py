@@ -0,0 +1,44 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from firebase_controller import FirebaseController, instrumentation, instrumented_script
+
+
+def main():
+    save_folder = Path(__file__).parent / "export"
+    with instrumented_script("discussion_analytics", report_folder=save_folder / "reports"):
+        _analyze(save_folder)
+
+
+def _analyze(save_folder: Path) -> None:
+    controller = FirebaseController(
+        certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
+        temporary_folder=save_folder,
+        force_refresh=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true",
+        use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
+        incremental_refresh=os.getenv("INCREMENTAL_DATABASE_FETCHING", "false").lower() == "true",
+    )
+
+    # The archives only live in memory, the query engine cannot see them
+    include_archives = os.getenv("INCLUDE_ARCHIVES", "false").lower() == "true"
+    if include_archives:
+        controller.load_archives()
+    use_query_engine = os.getenv("USE_QUERY_ENGINE", "false").lower() == "true" and not include_archives
+
+    with instrumentation.phase("load_messages"):
+        analytics = controller.analytics(use_query_engine=use_query_engine)
+    with instrumentation.phase("compute_metrics"):
+        report = analytics.report()
+
+    with instrumentation.phase("write_report"):
+        with pd.ExcelWriter(save_folder / "analytics.xlsx") as writer:
+            for sheet_name, frame in report.items():
+                frame.to_excel(writer, sheet_name=sheet_name, index=False)
+    print(report["summary"].to_string(index=False))
+    print(f"The report was saved to {save_folder / 'analytics.xlsx'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,24 @@
+from .async_firebase_controller import AsyncFirebaseController
+from .database_index import DatabaseIndex
+from .export_writers import ExportWriter, export_writer
 from .firebase_controller import FirebaseController
+from .instrumentation import Instrumentation, instrumentation, instrumented_script
+from .photo_bundle import PhotoBundleWriter
+from .query_engine import QueryEngine
+from .storage_gc import StorageGarbageCollector
 from .user_model import UserModel
 
 __all__ = [
+    AsyncFirebaseController.__name__,
+    DatabaseIndex.__name__,
+    ExportWriter.__name__,
+    export_writer.__name__,
     FirebaseController.__name__,
+    Instrumentation.__name__,
+    "instrumentation",
+    instrumented_script.__name__,
+    PhotoBundleWriter.__name__,
+    QueryEngine.__name__,
+    StorageGarbageCollector.__name__,
     UserModel.__name__,
 ]
@@ -0,0 +1,207 @@
+from typing import Any, Mapping
+
+import numpy as np
+import pandas as pd
+
+from .database_index import _section
+from .query_engine import QueryEngine
+
+_metier = list("MÉTIER")
+_discussion_keys = ["token", "student_id", "question_id"]
+_response_columns = _discussion_keys + ["teacher_id", "section", "metier", "asked_at", "answered_at", "latency"]
+
+_messages_query = """
+    SELECT messages.token, tokens.teacher_id, messages.student_id, messages.question_id, questions.section,
+        messages.message_id, messages.creator_id = messages.student_id AS from_student, messages.creation_timestamp,
+        messages.is_photo_url AS is_photo
+    FROM messages
+    JOIN tokens ON tokens.token = messages.token
+    LEFT JOIN questions ON questions.teacher_id = tokens.teacher_id AND questions.question_id = messages.question_id
+"""
+
+
+class DiscussionAnalytics:
+    """
+    Engagement metrics over every discussion message, held in a single columnar frame (one row per message) so each
+    metric is a grouped operation instead of a walk through the tree. A message is from the student when its creator is
+    the student of the answer, otherwise it is from the teacher. The messages of the tokens without a teacher (e.g.
+    unregistered classes) are left out, as they are from the exports.
+    """
+
+    def __init__(self, messages: pd.DataFrame):
+        self.messages = messages
+        self._responses: pd.DataFrame = None
+
+    @classmethod
+    def from_query_engine(cls, query_engine: QueryEngine) -> "DiscussionAnalytics":
+        """Reads the messages of the snapshot on disk from the query engine, without decoding the tree"""
+        return cls(_normalized(query_engine.dataframe(_messages_query)))
+
+    @classmethod
+    def from_tree(cls, tree: Mapping[str, Any]) -> "DiscussionAnalytics":
+        """Flattens the messages of a "v0_1_0" tree (e.g. a slice or a database with its archives) in a single pass"""
+        teacher_ids = {
+            token: node["metadata"].get("createdBy")
+            for token, node in _section(tree, "tokens").items()
+            if isinstance(node, dict) and isinstance(node.get("metadata"), dict)
+        }
+        questions = _section(tree, "questions")
+
+        # The keys are gathered once per discussion and only the fields of the messages are gathered per message
+        discussions = []
+        discussion_sizes = []
+        message_ids = []
+        creator_ids = []
+        timestamps = []
+        photos = []
+        for token, students in _section(tree, "answers").items():
+            teacher_id = teacher_ids.get(token)
+            if teacher_id is None or not isinstance(students, dict):
+                continue
+            teacher_questions = questions.get(teacher_id)
+            teacher_questions = teacher_questions if isinstance(teacher_questions, dict) else {}
+            for student_id, answers in students.items():
+                for question_id, answer in answers.items() if isinstance(answers, dict) else ():
+                    discussion = answer.get("discussion") if isinstance(answer, dict) else None
+                    if not isinstance(discussion, dict) or not discussion:
+                        continue
+                    question = teacher_questions.get(question_id)
+                    section = question.get("section") if isinstance(question, dict) else None
+                    discussions.append((token, teacher_id, student_id, question_id, section))
+                    discussion_sizes.append(len(discussion))
+                    message_ids.extend(discussion)
+                    for message in discussion.values():
+                        creator_ids.append(message.get("creatorId"))
+                        timestamps.append(message.get("creationTimeStamp"))
+                        photos.append(message.get("isPhotoUrl"))
+
+        keys = pd.DataFrame(discussions, columns=["token", "teacher_id", "student_id", "question_id", "section"])
+        messages = keys.loc[keys.index.repeat(discussion_sizes)].reset_index(drop=True)
+        return cls(
+            _normalized(
+                messages.assign(
+                    message_id=message_ids,
+                    from_student=np.array(creator_ids, dtype=object) == messages["student_id"].to_numpy(dtype=object),
+                    creation_timestamp=pd.array(timestamps, dtype="Int64"),
+                    is_photo=pd.array(photos, dtype="boolean"),
+                )
+            )
+        )
+
+    def messages_per_student(self) -> pd.DataFrame:
+        messages = self.messages.assign(from_teacher=~self.messages["from_student"])
+        return (
+            messages.groupby(["token", "teacher_id", "student_id"], observed=True)
+            .agg(
+                messages=("message_id", "size"),
+                student_messages=("from_student", "sum"),
+                teacher_messages=("from_teacher", "sum"),
+                photos=("is_photo", "sum"),
+                questions=("question_id", "nunique"),
+                first_message=("creation_timestamp", "min"),
+                last_message=("creation_timestamp", "max"),
+            )
+            .reset_index()
+        )
+
+    def teacher_responses(self) -> pd.DataFrame:
+        """
+        One row per run of consecutive student messages in a discussion, with the time the teacher took to answer it
+        (from the first message of the run to the next teacher message). The latency is missing for unanswered runs.
+        """
+        if self._responses is not None:
+            return self._responses
+
+        messages = self.messages.sort_values(_discussion_keys + ["creation_timestamp"], kind="stable")
+        keys = messages[_discussion_keys]
+        new_discussion = (keys != keys.shift()).any(axis=1)
+        new_run = new_discussion | (messages["from_student"] != messages["from_student"].shift())
+
+        # Once sorted, a run is represented by its first message. The runs alternate between the student and the
+        # teacher, so a student run is answered by the next run unless it ends the discussion
+        runs = messages[new_run]
+        ends_discussion = new_discussion[new_run].shift(-1, fill_value=True)
+        answered_at = runs["creation_timestamp"].shift(-1).where(~ends_discussion)
+        responses = runs.assign(asked_at=runs["creation_timestamp"], answered_at=answered_at)[runs["from_student"]]
+        responses = responses.assign(latency=responses["answered_at"] - responses["asked_at"])
+        self._responses = responses[_response_columns].reset_index(drop=True)
+        return self._responses
+
+    def teacher_response_latency(self) -> pd.DataFrame:
+        responses = self.teacher_responses()
+        return _latency_summary(responses, by=["teacher_id"])
+
+    def activity_per_section(self) -> pd.DataFrame:
+        messages = self.messages.assign(from_teacher=~self.messages["from_student"])
+        activity = messages.groupby("metier", observed=False).agg(
+            messages=("message_id", "size"),
+            student_messages=("from_student", "sum"),
+            teacher_messages=("from_teacher", "sum"),
+            photos=("is_photo", "sum"),
+            students=("student_id", "nunique"),
+            questions=("question_id", "nunique"),
+        )
+        latency = _latency_summary(self.teacher_responses(), by=["metier"]).set_index("metier")
+        return activity.join(latency[["answered", "unanswered", "median_latency_hours"]]).reset_index()
+
+    def summary(self) -> pd.DataFrame:
+        messages = self.messages
+        responses = self.teacher_responses()
+        latency_hours = responses["latency"].dropna().dt.total_seconds() / 3600
+        values = {
+            "classes": messages["token"].nunique(),
+            "teachers": messages["teacher_id"].nunique(),
+            "students": messages["student_id"].nunique(),
+            "messages": len(messages),
+            "student_messages": int(messages["from_student"].sum()),
+            "teacher_messages": int((~messages["from_student"]).sum()),
+            "photos": int(messages["is_photo"].sum()),
+            "first_message": messages["creation_timestamp"].min(),
+            "last_message": messages["creation_timestamp"].max(),
+            "answered_runs": int(responses["latency"].notna().sum()),
+            "unanswered_runs": int(responses["latency"].isna().sum()),
+            "median_latency_hours": latency_hours.median(),
+            "p90_latency_hours": latency_hours.quantile(0.9),
+        }
+        return pd.DataFrame({"metric": list(values), "value": list(values.values())})
+
+    def report(self) -> dict[str, pd.DataFrame]:
+        """All the metrics, by the name of their sheet in the report"""
+        return {
+            "summary": self.summary(),
+            "students": self.messages_per_student(),
+            "teachers": self.teacher_response_latency(),
+            "metier": self.activity_per_section(),
+        }
+
+
+def _normalized(messages: pd.DataFrame) -> pd.DataFrame:
+    """Gives the same compact types to the frames from the query engine and from the tree"""
+    messages = messages.dropna(subset=["creation_timestamp"])
+    section = pd.to_numeric(messages["section"], errors="coerce")
+    codes = section.where(section.between(0, len(_metier) - 1)).fillna(-1).astype(np.int8)
+    return messages.assign(
+        token=messages["token"].astype("category"),
+        teacher_id=messages["teacher_id"].astype("category"),
+        student_id=messages["student_id"].astype("category"),
+        question_id=messages["question_id"].astype("category"),
+        section=codes,
+        metier=pd.Categorical.from_codes(codes, categories=_metier),
+        from_student=messages["from_student"].astype(bool),
+        creation_timestamp=pd.to_datetime(messages["creation_timestamp"].astype(np.int64), unit="us"),
+        is_photo=messages["is_photo"].fillna(False).astype(bool),
+    ).reset_index(drop=True)
+
+
+def _latency_summary(responses: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    latency_hours = responses["latency"].dt.total_seconds() / 3600
+    grouped = responses.assign(latency_hours=latency_hours).groupby(by, observed=False)["latency_hours"]
+    return pd.DataFrame(
+        {
+            "answered": grouped.count(),
+            "unanswered": grouped.size() - grouped.count(),
+            "median_latency_hours": grouped.median(),
+            "mean_latency_hours": grouped.mean(),
+            "p90_latency_hours": grouped.quantile(0.9),
+        }
+    ).reset_index()
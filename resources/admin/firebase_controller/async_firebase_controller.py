@@ -0,0 +1,257 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from pathlib import Path
+from typing import Any, AsyncIterator, Mapping
+
+import firebase_admin
+from firebase_admin import auth, storage
+
+from .database_index import DatabaseIndex
+from .snapshot import Snapshot
+from .user_deletion import plan_user_deletion
+
+_database_version = "v0_1_0"
+
+
+class AsyncFirebaseController:
+    """
+    Asynchronous counterpart of FirebaseController which talks to the Realtime Database REST API through a pool of
+    connections, with at most [max_concurrent_requests] requests in flight. It shares the snapshot file of
+    FirebaseController and exposes the same accessors. It must be used as an async context manager:
+
+        async with AsyncFirebaseController(...) as controller:
+            await controller.load_database(force_download=True)
+    """
+
+    def __init__(
+        self,
+        certificate_path: Path,
+        temporary_folder: Path,
+        use_emulator: bool = True,
+        max_concurrent_requests: int = 16,
+    ):
+        if use_emulator:
+            os.environ["FIREBASE_DATABASE_EMULATOR_HOST"] = "localhost:9000"
+            os.environ["FIREBASE_AUTH_EMULATOR_HOST"] = "localhost:9099"
+            os.environ["STORAGE_EMULATOR_HOST"] = "http://localhost:9199"
+
+        self._certificate_path = certificate_path
+        self._database_url = "https://monstageenimages-default-rtdb.firebaseio.com"
+        self._database_namespace = "monstageenimages-default-rtdb"
+        self._bucket_url = "monstageenimages.appspot.com"
+        self._emulator_host = os.getenv("FIREBASE_DATABASE_EMULATOR_HOST")
+
+        self._temporary_folder = temporary_folder
+        self._temporary_database_filepath = self._temporary_folder / "firebase_export.sqlite"
+
+        self._max_concurrent_requests = max_concurrent_requests
+        self._semaphore: asyncio.Semaphore = None
+        self._client = None
+        self._credential: firebase_admin.credentials.Certificate = None
+        self._access_token: str = None
+        self._access_token_expiry: datetime = None
+
+        self._database: Mapping[str, Any] = None
+        self._index: DatabaseIndex = None
+
+    async def __aenter__(self) -> "AsyncFirebaseController":
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("AsyncFirebaseController requires httpx, install it with `pip install httpx`")
+
+        # Storage and Authentication are still accessed through the Admin SDK
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(
+                firebase_admin.credentials.Certificate(self._certificate_path),
+                {"databaseURL": self._database_url, "storageBucket": self._bucket_url},
+            )
+        if self._emulator_host is None:
+            self._credential = firebase_admin.credentials.Certificate(self._certificate_path)
+
+        self._semaphore = asyncio.Semaphore(self._max_concurrent_requests)
+        self._client = httpx.AsyncClient(
+            base_url=f"http://{self._emulator_host}" if self._emulator_host else self._database_url,
+            limits=httpx.Limits(max_connections=self._max_concurrent_requests),
+            timeout=httpx.Timeout(60.0),
+        )
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self._client.aclose()
+        self._client = None
+
+    # REST API
+
+    async def get(self, path: str, **query: Any) -> Any:
+        """GET [path] (relative to the database version), the [query] values are JSON encoded (e.g. orderBy="$key")"""
+        return await self._request("GET", path, params={key: json.dumps(value) for key, value in query.items()})
+
+    async def shallow_keys(self, path: str) -> list[str]:
+        data = await self._request("GET", path, params={"shallow": "true"})
+        return list(data.keys()) if isinstance(data, dict) else []
+
+    async def paginate(self, path: str, page_size: int = 500) -> AsyncIterator[tuple[str, Any]]:
+        """Yields the children of [path] in key order, fetching [page_size] of them per request"""
+        last_key = None
+        while True:
+            if last_key is None:
+                page = await self.get(path, orderBy="$key", limitToFirst=page_size)
+            else:
+                # startAt is inclusive, so the last key of the previous page is fetched again and skipped
+                page = await self.get(path, orderBy="$key", startAt=last_key, limitToFirst=page_size + 1)
+            if not isinstance(page, dict):
+                return
+
+            keys = sorted(page.keys(), key=_key_order)
+            if last_key is not None:
+                keys = [key for key in keys if key != last_key]
+            for key in keys:
+                yield key, page[key]
+
+            if not keys or len(page) < page_size + (last_key is not None):
+                return
+            last_key = keys[-1]
+
+    async def _request(self, method: str, path: str, params: dict | None = None, json_body: Any = None) -> Any:
+        params = {} if params is None else dict(params)
+        headers = {}
+        if self._emulator_host:
+            params["ns"] = self._database_namespace
+            headers["Authorization"] = "Bearer owner"
+        else:
+            headers["Authorization"] = f"Bearer {await self._get_access_token()}"
+
+        url = f"/{_database_version}/{path}".rstrip("/") + ".json"
+        async with self._semaphore:
+            response = await self._client.request(method, url, params=params, headers=headers, json=json_body)
+        response.raise_for_status()
+        return response.json()
+
+    async def _get_access_token(self) -> str:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if self._access_token is None or self._access_token_expiry - now < timedelta(minutes=5):
+            token_info = await asyncio.to_thread(self._credential.get_access_token)
+            self._access_token = token_info.access_token
+            self._access_token_expiry = token_info.expiry
+        return self._access_token
+
+    # Database snapshot
+
+    async def load_database(self, force_download: bool = False) -> Mapping[str, Any]:
+        if self._database is not None and not force_download:
+            return self._database
+
+        if not self._temporary_database_filepath.exists() or force_download:
+            print("Downloading the database...")
+            data = await self._full_database()
+            Snapshot.write(self._temporary_database_filepath, data)
+            self._database = data
+        else:
+            print("Using the predownloaded database...")
+            self._database = Snapshot(self._temporary_database_filepath)
+
+        self._index = None
+        return self._database
+
+    async def _full_database(self) -> dict:
+        """
+        Downloads each top-level node concurrently. The answers are fetched one token at a time as these subtrees can
+        be large, the other nodes are made of many small records and are paginated.
+        """
+
+        async def fetch_node(node: str) -> dict:
+            if node == "answers":
+                tokens = await self.shallow_keys(node)
+                values = await asyncio.gather(*(self.get(f"{node}/{token}") for token in tokens))
+                return dict(zip(tokens, values))
+            return {key: value async for key, value in self.paginate(node)}
+
+        nodes = await self.shallow_keys("")
+        return dict(zip(nodes, await asyncio.gather(*(fetch_node(node) for node in nodes))))
+
+    @property
+    def database(self) -> Mapping[str, Any]:
+        if self._database is None:
+            raise RuntimeError("The database is not loaded, call `await controller.load_database()` first")
+        return self._database
+
+    @property
+    def index(self) -> DatabaseIndex:
+        if self._index is None:
+            self._index = DatabaseIndex(self.database)
+        return self._index
+
+    # Accessors
+
+    @property
+    def teaching_tokens(self) -> tuple[str]:
+        return self.index.teaching_tokens
+
+    def teacher_id(self, teaching_token: str) -> str | None:
+        return self.index.teacher_id(teaching_token=teaching_token)
+
+    def student_ids(self, teaching_token: str) -> tuple[str]:
+        return self.index.student_ids(teaching_token=teaching_token)
+
+    def answers(self, teaching_token: str, student_id: str) -> dict:
+        return self.index.answers(teaching_token=teaching_token, student_id=student_id)
+
+    def questions(self, teacher_id: str) -> dict:
+        return self.index.questions(teacher_id=teacher_id)
+
+    def question(self, teacher_id: str, question_id: str) -> dict | None:
+        return self.questions(teacher_id=teacher_id).get(question_id)
+
+    def user(self, user_id: str) -> dict | None:
+        return self.index.user(user_id=user_id)
+
+    # Writes
+
+    async def set_user(self, user: dict) -> None:
+        await self._request("PUT", f"users/{user['id']}", json_body=user)
+
+    async def set_users(self, users: list[dict], chunk_size: int = 500) -> None:
+        chunks = [users[start : start + chunk_size] for start in range(0, len(users), chunk_size)]
+        await asyncio.gather(
+            *(self._request("PATCH", "users", json_body={user["id"]: user for user in chunk}) for chunk in chunks)
+        )
+
+    async def delete_user(self, user_id: str, dry_run: bool = False) -> None:
+        plan = plan_user_deletion(index=self.index, user_id=user_id)
+        blobs = await asyncio.to_thread(lambda: list(storage.bucket().list_blobs(prefix=f"{user_id}/")))
+
+        if dry_run:
+            print(f"The following {len(plan)} paths would be deleted from the database:")
+            for path in plan:
+                print(f"    /{_database_version}/{path}")
+            print(f"The {len(blobs)} storage files under {user_id}/ would be deleted")
+            print(f"The user {user_id} would be deleted from Firebase Authentication")
+            return
+
+        # Remove everything from the database at once, either all the paths are deleted or none of them are
+        await self._request("PATCH", "", json_body=plan)
+
+        # Remove all the storage files of the user
+        async def delete_blob(blob) -> None:
+            async with self._semaphore:
+                await asyncio.to_thread(blob.delete)
+
+        await asyncio.gather(*(delete_blob(blob) for blob in blobs))
+
+        # Delete the user from Firebase Authentication
+        try:
+            await asyncio.to_thread(auth.delete_user, user_id)
+        except:
+            pass
+
+
+def _key_order(key: str) -> tuple:
+    # The database orders the keys that are 32-bit integers numerically, before all the other keys
+    if key.isdigit() and (key == "0" or not key.startswith("0")) and int(key) < 2**31:
+        return 0, int(key), ""
+    return 1, 0, key
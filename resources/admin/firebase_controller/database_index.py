@@ -0,0 +1,95 @@
+from functools import cached_property
+from typing import Any, Mapping
+
+from .instrumentation import instrumentation
+
+
+class TokenRecord:
+    __slots__ = ("teacher_id", "student_ids", "is_teaching_token")
+
+    def __init__(self, teacher_id: str | None, student_ids: tuple[str], is_teaching_token: bool):
+        self.teacher_id = teacher_id
+        self.student_ids = student_ids
+        self.is_teaching_token = is_teaching_token
+
+
+class DatabaseIndex:
+    """
+    Flat lookup tables over the raw "v0_1_0" tree. Each table is built the first time it is needed, once, so every
+    accessor is a single dictionary lookup instead of a walk through the nested tree.
+    """
+
+    def __init__(self, tree: Mapping[str, Any]):
+        self._tree = tree
+
+    @cached_property
+    def teaching_tokens(self) -> tuple[str]:
+        return tuple(token for token, record in self._tokens.items() if record.is_teaching_token)
+
+    def teacher_id(self, teaching_token: str) -> str | None:
+        record = self._tokens.get(teaching_token)
+        return None if record is None else record.teacher_id
+
+    def student_ids(self, teaching_token: str) -> tuple[str]:
+        record = self._tokens.get(teaching_token)
+        return () if record is None else record.student_ids
+
+    def answers(self, teaching_token: str, student_id: str) -> dict:
+        return self._answers.get((teaching_token, student_id), {})
+
+    def questions(self, teacher_id: str) -> dict:
+        return self._questions.get(teacher_id, {})
+
+    def user(self, user_id: str) -> dict | None:
+        return self._users.get(user_id)
+
+    @cached_property
+    def _tokens(self) -> dict[str, TokenRecord]:
+        with instrumentation.phase("build_index"):
+            records = {}
+            for token, node in _section(self._tree, "tokens").items():
+                if not isinstance(node, dict):
+                    continue
+
+                metadata = node.get("metadata")
+                connected_users = node.get("connectedUsers")
+                records[token] = TokenRecord(
+                    teacher_id=metadata.get("createdBy") if isinstance(metadata, dict) else None,
+                    student_ids=tuple(connected_users.keys()) if isinstance(connected_users, dict) else (),
+                    is_teaching_token="metadata" in node,
+                )
+            return records
+
+    @cached_property
+    def _answers(self) -> dict[tuple[str, str], dict]:
+        with instrumentation.phase("build_index"):
+            return {
+                (token, student_id): answers
+                for token, students in _section(self._tree, "answers").items()
+                if isinstance(students, dict)
+                for student_id, answers in students.items()
+                if isinstance(answers, dict)
+            }
+
+    @cached_property
+    def _questions(self) -> dict[str, dict]:
+        with instrumentation.phase("build_index"):
+            return {
+                teacher_id: questions
+                for teacher_id, questions in _section(self._tree, "questions").items()
+                if isinstance(questions, dict)
+            }
+
+    @cached_property
+    def _users(self) -> dict[str, dict]:
+        with instrumentation.phase("build_index"):
+            return {
+                user["id"]: user
+                for user in _section(self._tree, "users").values()
+                if isinstance(user, dict) and "firstName" in user
+            }
+
+
+def _section(tree: Mapping[str, Any], name: str) -> dict:
+    section = tree.get(name)
+    return section if isinstance(section, dict) else {}
@@ -0,0 +1,100 @@
+import csv
+from pathlib import Path
+
+
+class ExportWriter:
+    """
+    Writes the rows of a table to a file one at a time so the whole table never has to be held in memory. The writers
+    are context managers, the file is finalized when the context exits.
+    """
+
+    def __init__(self, filepath: Path, columns: list[str]):
+        self._filepath = filepath
+        self._columns = columns
+        self._filepath.parent.mkdir(parents=True, exist_ok=True)
+
+    def write_row(self, row: list) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self) -> "ExportWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class XlsxExportWriter(ExportWriter):
+    def __init__(self, filepath: Path, columns: list[str]):
+        super().__init__(filepath=filepath, columns=columns)
+        from openpyxl import Workbook
+
+        # In write-only mode, openpyxl streams the rows to a temporary file instead of keeping the cells in memory
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet()
+        self._sheet.append(columns)
+
+    def write_row(self, row: list) -> None:
+        self._sheet.append(row)
+
+    def close(self) -> None:
+        self._workbook.save(self._filepath)
+
+
+class CsvExportWriter(ExportWriter):
+    def __init__(self, filepath: Path, columns: list[str]):
+        super().__init__(filepath=filepath, columns=columns)
+        self._file = open(self._filepath, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def write_row(self, row: list) -> None:
+        self._writer.writerow(row)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetExportWriter(ExportWriter):
+    def __init__(self, filepath: Path, columns: list[str], row_group_size: int = 10_000):
+        super().__init__(filepath=filepath, columns=columns)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Exporting to parquet requires pyarrow, install it with `pip install pyarrow`")
+
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(self._filepath, self._schema)
+        self._row_group_size = row_group_size
+        self._buffer: list[list] = []
+
+    def write_row(self, row: list) -> None:
+        self._buffer.append(row)
+        if len(self._buffer) >= self._row_group_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        # A missing value stays null instead of becoming the string "None"
+        columns = [[None if row[i] is None else str(row[i]) for row in self._buffer] for i in range(len(self._columns))]
+        self._writer.write_table(self._pyarrow.Table.from_arrays(columns, schema=self._schema))
+        self._buffer = []
+
+
+_export_writers = {".xlsx": XlsxExportWriter, ".csv": CsvExportWriter, ".parquet": ParquetExportWriter}
+
+
+def export_writer(filepath: Path, columns: list[str]) -> ExportWriter:
+    """Returns the writer matching the extension of [filepath]"""
+    if filepath.suffix not in _export_writers:
+        raise ValueError(f"Unsupported export format {filepath.suffix}, expected one of {list(_export_writers)}")
+    return _export_writers[filepath.suffix](filepath=filepath, columns=columns)
@@ -1,20 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import json
 from functools import cached_property
 import os
 from pathlib import Path
-from typing import Any
+import time
+from typing import TYPE_CHECKING, Any, Iterator, Mapping
 
 import firebase_admin
 from firebase_admin import db, storage, auth
-import pandas
+
+from .database_index import DatabaseIndex
+from .instrumentation import instrumentation
+from .query_engine import QueryEngine
+from .snapshot import Snapshot
+from .storage_gc import StorageGarbageCollector, referenced_storage_paths
+from .storage_mirror import StorageMirror
+from .token_archives import (
+    ArchivedDatabase,
+    archivable_tokens,
+    decode_token_archive,
+    encode_token_archive,
+    plan_token_archives,
+    token_archive_name,
+    token_archive_prefix,
+)
+from .user_deletion import plan_user_deletion
+
+if TYPE_CHECKING:
+    from .analytics import DiscussionAnalytics
 
 _app_version = "1.2.2"
 _database_version = "v0_1_0"
+_max_concurrent_requests = 16
+# The sections fetched one class at a time by the incremental syncs, the others are small enough to be fetched whole
+_split_sections = ("answers", "tokens")
 
 
 class FirebaseController:
     def __init__(
-        self, certificate_path: Path, temporary_folder: Path, force_refresh: bool = False, use_emulator: bool = True
+        self,
+        certificate_path: Path,
+        temporary_folder: Path,
+        force_refresh: bool = False,
+        use_emulator: bool = True,
+        incremental_refresh: bool = False,
     ):
 
         if use_emulator:
@@ -27,58 +57,81 @@ class FirebaseController:
         self._bucket_url = "monstageenimages.appspot.com"
 
         self._temporary_folder = temporary_folder
-        self._temporary_database_filepath = self._temporary_folder / "firebase_export.json"
+        self._temporary_database_filepath = self._temporary_folder / "firebase_export.sqlite"
+        self._temporary_etags_filepath = self._temporary_folder / "firebase_export_etags.json"
         self._temporary_bucket_folder = self._temporary_folder / "storage"
+        self._incremental_refresh = incremental_refresh
 
         self._initialize_database()
-        self._database: pandas.DataFrame = None
+        self._database: Mapping[str, Any] = None
+        self._index: DatabaseIndex = None
+        self._query_engine: QueryEngine = None
         if force_refresh or use_emulator:
-            self.to_pandas(force_download=True)
+            self.load_database(force_download=True)
+
+    @classmethod
+    def from_snapshot(cls, temporary_folder: Path) -> "FirebaseController":
+        """
+        Opens a previously downloaded database without connecting to Firebase. The resulting controller can only be
+        used to read the snapshot.
+        """
+        controller = cls.__new__(cls)
+        controller._temporary_folder = temporary_folder
+        controller._temporary_database_filepath = temporary_folder / "firebase_export.sqlite"
+        controller._temporary_etags_filepath = temporary_folder / "firebase_export_etags.json"
+        controller._temporary_bucket_folder = temporary_folder / "storage"
+        controller._incremental_refresh = False
+        controller._database = None
+        controller._index = None
+        controller._query_engine = None
+        return controller
 
     def user(self, user_id: str) -> dict | None:
-        if user_id not in self._users:
-            return None
-        return self._users[user_id]
+        return self.index.user(user_id=user_id)
 
     def set_required_app_version(self) -> None:
         db.reference("appInfo").child("requiredVersion").set(_app_version)
 
     def set_user(self, user: dict) -> None:
         db.reference(f"/{_database_version}").child("users").child(user["id"]).set(user)
-
-    def delete_user(self, user_id: str) -> None:
-        # Remove the questions this user has registered
-        db.reference(f"/{_database_version}").child("questions").child(user_id).delete()
-
-        # Remove the answers provided by the user
-        for token in self.teaching_tokens:
-            # Remove the answers associated with that token
-            db.reference(f"/{_database_version}").child("answers").child(token).child(user_id).delete()
-
-            # Remove all the storage files associated with that token
-            for blob in storage.bucket().list_blobs(prefix=user_id + "/"):
-                blob.delete()
-
-            # Fix the tokens
-            if self.teacher_id(teaching_token=token) == user_id:
-                # If we are the teacher disconnect all the students
-                for student_id in self.student_ids(teaching_token=token):
-                    db.reference(f"/{_database_version}").child("users").child(student_id).child("tokens").child(
-                        "connected"
-                    ).child(token).delete()
-                    db.reference(f"/{_database_version}").child("users").child(student_id).child("tokens").child(
-                        "userWithExtendedPermissions"
-                    ).child(user_id).delete()
-                db.reference(f"/{_database_version}").child("tokens").child(token).delete()
-                db.reference(f"/{_database_version}").child("tokens").child("existing").child(token).delete()
-            else:
-                # Disconnect from the token if we are connected
-                db.reference(f"/{_database_version}").child("tokens").child(token).child("connectedUsers").child(
-                    user_id
-                ).delete()
-
-        # Remove the user from the users list
-        db.reference(f"/{_database_version}").child("users").child(user_id).delete()
+        instrumentation.count("rtdb.writes")
+
+    def set_users(self, users: list[dict], chunk_size: int = 500) -> None:
+        """Writes [users] using one multi-location update per [chunk_size] users instead of one request per user"""
+        for start in range(0, len(users), chunk_size):
+            chunk = users[start : start + chunk_size]
+            db.reference(f"/{_database_version}").child("users").update({user["id"]: user for user in chunk})
+            instrumentation.count("rtdb.writes")
+
+    def plan_user_deletion(self, user_id: str) -> dict[str, None]:
+        """
+        Lists, from the local database, every path (relative to the database version) that must be removed to delete
+        [user_id]. The result can be applied as is as a multi-location update.
+        """
+        return plan_user_deletion(index=self.index, user_id=user_id)
+
+    def delete_user(self, user_id: str, dry_run: bool = False) -> None:
+        plan = self.plan_user_deletion(user_id=user_id)
+        blobs = list(storage.bucket().list_blobs(prefix=f"{user_id}/"))
+
+        if dry_run:
+            print(f"The following {len(plan)} paths would be deleted from the database:")
+            for path in plan:
+                print(f"    /{_database_version}/{path}")
+            print(f"The {len(blobs)} storage files under {user_id}/ would be deleted")
+            print(f"The user {user_id} would be deleted from Firebase Authentication")
+            return
+
+        # Remove everything from the database at once, either all the paths are deleted or none of them are
+        db.reference(f"/{_database_version}").update(plan)
+        instrumentation.count("rtdb.writes")
+
+        # Remove all the storage files of the user
+        with instrumentation.phase("delete_blobs"), ThreadPoolExecutor(
+            max_workers=_max_concurrent_requests
+        ) as executor:
+            list(executor.map(lambda blob: blob.delete(), blobs))
+        instrumentation.count("storage.blobs_deleted", len(blobs))
 
         # Delete the user from Firebase Authentication
         try:
@@ -88,89 +141,434 @@ class FirebaseController:
 
     @cached_property
     def authenticated_users(self) -> dict[str, str]:
-        return {user.uid: user.email for user in auth.list_users().iterate_all()}
+        return {uid: email for page in self.authenticated_user_pages() for uid, email in page.items()}
 
-    @cached_property
+    def authenticated_user_pages(self, page_size: int = 1000) -> Iterator[dict[str, str]]:
+        """Streams the users of Firebase Authentication one page at a time, each page maps the uid to the email"""
+        page = auth.list_users(max_results=page_size)
+        while page is not None:
+            yield {user.uid: user.email for user in page.users}
+            page = page.get_next_page()
+
+    @property
     def teaching_tokens(self) -> tuple[str]:
-        return tuple(
-            token
-            for token in self.database["tokens"].keys()
-            if isinstance(self.database["tokens"][token], dict) and "metadata" in self.database["tokens"][token]
-        )
+        return self.index.teaching_tokens
 
     def teacher_id(self, teaching_token: str) -> str | None:
-        try:
-            return self.database["tokens"][teaching_token]["metadata"]["createdBy"]
-        except KeyError:
-            return None
+        return self.index.teacher_id(teaching_token=teaching_token)
 
     def student_ids(self, teaching_token: str) -> tuple[str]:
-        try:
-            return tuple(user_id for user_id in self.database["tokens"][teaching_token]["connectedUsers"].keys())
-        except KeyError:
-            return ()
+        return self.index.student_ids(teaching_token=teaching_token)
 
     def answers(self, teaching_token: str, student_id: str) -> dict:
-        try:
-            return self.database["answers"][teaching_token][student_id]
-        except KeyError:
-            return {}
+        return self.index.answers(teaching_token=teaching_token, student_id=student_id)
 
     def questions(self, teacher_id: str) -> dict:
-        try:
-            questions = self.database["questions"][teacher_id]
-            return questions if isinstance(questions, dict) else {}
-        except KeyError:
-            return {}
+        return self.index.questions(teacher_id=teacher_id)
 
     def question(self, teacher_id: str, question_id: str) -> dict | None:
-        questions = self.questions(teacher_id=teacher_id)
-        if question_id not in questions:
-            return None
-        return questions[question_id]
-
-    @cached_property
-    def _users(self) -> dict:
-        return {user["id"]: user for user in self.database["users"] if isinstance(user, dict) and "firstName" in user}
+        return self.questions(teacher_id=teacher_id).get(question_id)
 
     @property
-    def database(self) -> pandas.DataFrame:
+    def database(self) -> Mapping[str, Any]:
         if self._database is None:
-            self.to_pandas()
+            self.load_database()
         return self._database
 
-    def to_pandas(self, force_download: bool = False) -> pandas.DataFrame:
+    @property
+    def index(self) -> DatabaseIndex:
+        if self._index is None:
+            self._index = DatabaseIndex(self.database)
+        return self._index
+
+    @property
+    def query_engine(self) -> QueryEngine:
+        """
+        Indexed SQLite copy of the database. It is created next to the snapshot and only the tables whose section
+        changed since the last run are rebuilt.
+        """
+        if self._query_engine is None:
+            self.load_database()
+            self._query_engine = QueryEngine(self._temporary_folder / "firebase_query.sqlite")
+            self._query_engine.refresh(Snapshot(self._temporary_database_filepath))
+        return self._query_engine
+
+    def analytics(self, use_query_engine: bool = False) -> "DiscussionAnalytics":
+        """
+        Engagement metrics over all the discussions of the loaded database, slices and archives included. With
+        [use_query_engine], the messages are read from the query engine instead, which only holds the snapshot on disk.
+        """
+        # Imported here so pandas and numpy are only loaded by the scripts which compute the metrics
+        from .analytics import DiscussionAnalytics
+
+        if use_query_engine:
+            return DiscussionAnalytics.from_query_engine(self.query_engine)
+        return DiscussionAnalytics.from_tree(self.database)
+
+    def load_database(self, force_download: bool = False) -> Mapping[str, Any]:
         if self._database is not None and not force_download:
             return self._database
 
         if not self._temporary_database_filepath.exists() or force_download:
             print("Downloading the database...")
             # Fetch data
-            data = self._full_database()
-
-            # Save data to JSON file
-            self._temporary_database_filepath.parent.mkdir(parents=True, exist_ok=True)
-            with open(self._temporary_database_filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2)
+            etags = None
+            with instrumentation.phase("download_database"):
+                if self._incremental_refresh:
+                    data, etags = self._incremental_database()
+                else:
+                    data = self._full_database()
+
+            # Save data to the snapshot file
+            with instrumentation.phase("write_snapshot"):
+                Snapshot.write(self._temporary_database_filepath, data)
+
+            # The ETags are only saved once the data they describe are on disk
+            if etags is not None:
+                with open(self._temporary_etags_filepath, "w", encoding="utf-8") as f:
+                    json.dump(etags, f)
+            self._database = data
         else:
             print("Using the predownloaded database...")
+            self._database = Snapshot(self._temporary_database_filepath)
+
+        self._index = None
+        if self._query_engine is not None:
+            self._query_engine.close()
+            self._query_engine = None
+        return self._database
+
+    def load_database_slice(
+        self,
+        start: int | None = None,
+        end: int | None = None,
+        teacher_ids: list[str] | None = None,
+        tokens: list[str] | None = None,
+    ) -> Mapping[str, Any]:
+        """
+        Downloads only what is needed to export the discussions of the classes in [tokens] and of the classes created
+        by [teacher_ids] (all the classes if both are None), keeping the messages created in [start, end[ (in
+        microseconds since the epoch). The filters are evaluated by the database so only the slice is transferred. The
+        slice replaces the loaded database but is not saved, the snapshot on disk still holds the full database.
+        When a time window is given, the answers only hold the discussions with at least one message in the window.
+        """
+        print("Downloading the requested slice of the database...")
+        root = db.reference(f"/{_database_version}")
+
+        def fetch(path: str, shallow: bool = False) -> Any:
+            return _record_read(root.child(path).get(shallow=shallow))
+
+        def fetch_classes(teacher_id: str) -> dict:
+            query = root.child("tokens").order_by_child("metadata/createdBy").equal_to(teacher_id)
+            return _record_read(query.get()) or {}
+
+        def fetch_discussion(path: str) -> dict:
+            query = root.child(f"{path}/discussion").order_by_child("creationTimeStamp")
+            if start is not None:
+                query = query.start_at(start)
+            if end is not None:
+                query = query.end_at(end - 1)
+            return _record_read(query.get()) or {}
+
+        with instrumentation.phase("download_database_slice"), ThreadPoolExecutor(
+            max_workers=_max_concurrent_requests
+        ) as executor:
+            # The classes
+            if teacher_ids is None and tokens is None:
+                token_nodes = fetch("tokens") or {}
+            elif teacher_ids is not None:
+                token_nodes = {
+                    token: node for nodes in executor.map(fetch_classes, teacher_ids) for token, node in nodes.items()
+                }
+                if tokens is not None:
+                    token_nodes = {token: node for token, node in token_nodes.items() if token in tokens}
+            else:
+                nodes = executor.map(fetch, [f"tokens/{token}" for token in tokens])
+                token_nodes = {token: node for token, node in zip(tokens, nodes) if node is not None}
+            classes = DatabaseIndex({"tokens": token_nodes})
+
+            # The teachers, their questions and the students of the classes
+            class_teacher_ids = sorted(
+                {classes.teacher_id(teaching_token=token) for token in classes.teaching_tokens} - {None}
+            )
+            memberships = [
+                (token, student_id)
+                for token in classes.teaching_tokens
+                for student_id in classes.student_ids(teaching_token=token)
+            ]
+            user_ids = sorted({*class_teacher_ids} | {student_id for _, student_id in memberships})
+            users = executor.map(fetch, [f"users/{user_id}" for user_id in user_ids])
+            questions = executor.map(fetch, [f"questions/{teacher_id}" for teacher_id in class_teacher_ids])
+
+            # The discussions, filtered on their creation time
+            answers = {}
+            answer_paths = [f"answers/{token}/{student_id}" for token, student_id in memberships]
+            if start is None and end is None:
+                for (token, student_id), value in zip(memberships, executor.map(fetch, answer_paths)):
+                    if value is not None:
+                        answers.setdefault(token, {})[student_id] = value
+            else:
+                question_ids = executor.map(lambda path: fetch(path, shallow=True), answer_paths)
+                discussions = [
+                    (token, student_id, question_id)
+                    for (token, student_id), student_answers in zip(memberships, question_ids)
+                    for question_id in (student_answers or {})
+                ]
+                messages = executor.map(
+                    fetch_discussion,
+                    [f"answers/{token}/{student}/{question}" for token, student, question in discussions],
+                )
+                for (token, student_id, question_id), discussion in zip(discussions, messages):
+                    if discussion:
+                        answers.setdefault(token, {}).setdefault(student_id, {})[question_id] = {
+                            "discussion": dict(discussion)
+                        }
+
+            data = {
+                "answers": answers,
+                "questions": {
+                    teacher_id: value for teacher_id, value in zip(class_teacher_ids, questions) if value is not None
+                },
+                "tokens": token_nodes,
+                "users": {user_id: value for user_id, value in zip(user_ids, users) if value is not None},
+            }
+
+        message_count = sum(
+            len(answer.get("discussion") or {})
+            for students in answers.values()
+            for student_answers in students.values()
+            for answer in student_answers.values()
+            if isinstance(answer, dict)
+        )
+        print(f"{len(classes.teaching_tokens)} classes and {message_count} messages were downloaded")
 
-        self._database = pandas.read_json(self._temporary_database_filepath)
+        self._database = data
+        self._index = None
+        if self._query_engine is not None:
+            self._query_engine.close()
+            self._query_engine = None
         return self._database
 
     def download_storage(self, force_download: bool = False):
-        if not self._temporary_bucket_folder.exists() or force_download:
-            print("Downloading all the files, this may take a while...")
+        print("Synchronizing the storage files, this may take a while...")
+        with instrumentation.phase("download_storage"):
+            mirror = StorageMirror(bucket=storage.bucket(), folder=self._temporary_bucket_folder)
+            mirror.sync(force_download=force_download)
+
+    def collect_storage_garbage(
+        self, grace_period: timedelta, dry_run: bool = True, max_deletes_per_second: float = 50.0
+    ) -> dict:
+        """
+        Deletes the storage files that no discussion of the database refers to anymore, see StorageGarbageCollector.
+        The database should be freshly downloaded, the grace period only protects the files uploaded since then.
+        """
+        # Without the answers every photo would look orphaned
+        if "answers" not in self.database:
+            raise ValueError("The database has no answers, refusing to collect the storage garbage")
+
+        with instrumentation.phase("collect_storage_garbage"):
+            # The photos of the archived classes are still referenced, by their archive
+            answers = ArchivedDatabase(self.database, self._download_token_archives())["answers"]
+            collector = StorageGarbageCollector(
+                bucket=storage.bucket(),
+                referenced_paths=referenced_storage_paths(answers),
+                grace_period=grace_period,
+                max_workers=_max_concurrent_requests,
+                max_deletes_per_second=max_deletes_per_second,
+            )
+            return collector.collect(dry_run=dry_run)
+
+    def archive_tokens(self, cutoff: int, dry_run: bool = False) -> list[str]:
+        """
+        Moves the classes without any activity since [cutoff] (in microseconds since the epoch) out of the database,
+        into one compressed archive per token in the storage. Each archive is read back before its class is removed.
+        Returns the archived tokens.
+        """
+        plans = plan_token_archives(self.database, archivable_tokens(self.database, cutoff=cutoff))
+        if dry_run:
+            for token, paths in plans.items():
+                print(f"The class {token} would be archived to {token_archive_name(token)} ({len(paths)} paths)")
+            return list(plans)
+
+        root = db.reference(f"/{_database_version}")
+        bucket = storage.bucket()
+
+        def archive(token: str) -> str | None:
+            # A message posted or a student connected since the database was downloaded would be lost
+            etags = {}
+            for path in (f"answers/{token}", f"tokens/{token}"):
+                value, etags[path] = root.child(path).get(etag=True)
+                if _record_read(value) != plans[token].get(path):
+                    return f"The class {token} changed since the database was downloaded ({path})"
+
+            blob = bucket.blob(token_archive_name(token))
+            data = encode_token_archive(token, plans[token], archived_at=int(time.time() * 1_000_000))
+            try:
+                # Never replace an existing archive, e.g. the one of a token that was handed out again since
+                blob.upload_from_string(data, content_type="application/gzip", if_generation_match=0)
+            except Exception as e:
+                return f"The archive of {token} could not be uploaded ({e})"
+            if decode_token_archive(blob.download_as_bytes())["paths"] != plans[token]:
+                return f"The archive of {token} could not be read back, the class was left in the database"
+
+            # Last check before the removal, the class may have changed while the archive was uploaded
+            for path, etag in etags.items():
+                changed, value, _ = root.child(path).get_if_changed(etag)
+                _record_read(value)
+                if changed:
+                    blob.delete()
+                    return f"The class {token} changed while it was archived ({path}), it was left in the database"
+
+            # The routing nodes are rebuilt by the triggers if the class is restored
+            root.update({**{path: None for path in plans[token]}, f"notificationRouting/{token}": None})
+            instrumentation.count("rtdb.writes")
+            return None
+
+        with instrumentation.phase("archive_tokens"), ThreadPoolExecutor(
+            max_workers=_max_concurrent_requests
+        ) as executor:
+            errors = dict(zip(plans, executor.map(archive, plans)))
+
+        archived = [token for token, error in errors.items() if error is None]
+        print(f"{len(archived)} out of {len(plans)} classes were archived")
+        for error in errors.values():
+            if error is not None:
+                print(f"    {error}")
+        return archived
+
+    def restore_tokens(self, tokens: list[str], dry_run: bool = False) -> list[str]:
+        """
+        Moves archived classes back into the database and removes their archive. A class is not restored if its token
+        is in use in the database. Returns the restored tokens.
+        """
+        root = db.reference(f"/{_database_version}")
+        bucket = storage.bucket()
+
+        def restore(token: str) -> str | None:
+            blob = bucket.blob(token_archive_name(token))
+            if not blob.exists():
+                return f"The class {token} has no archive"
+            archive = decode_token_archive(blob.download_as_bytes())
+
+            for section in ("answers", "tokens"):
+                if _record_read(root.child(f"{section}/{token}").get(shallow=True)) is not None:
+                    return f"The class {token} is in the database ({section}/{token}), it was not restored"
+
+            # Writing the references of a user deleted since the archiving would recreate a partial user
+            user_ids = {path.split("/")[1] for path in archive["paths"] if path.startswith("users/")}
+            deleted_user_ids = {
+                user_id
+                for user_id in user_ids
+                if _record_read(root.child(f"users/{user_id}").get(shallow=True)) is None
+            }
+            paths = {
+                path: value
+                for path, value in archive["paths"].items()
+                if not (path.startswith("users/") and path.split("/")[1] in deleted_user_ids)
+            }
+            if deleted_user_ids:
+                print(f"{len(deleted_user_ids)} users of the class {token} were deleted since, they are skipped")
+            if dry_run:
+                print(f"The class {token} would be restored from {blob.name} ({len(paths)} paths)")
+                return None
+
+            root.update(paths)
+            instrumentation.count("rtdb.writes")
+            blob.delete()
+            return None
 
-            # Download all files
-            self._temporary_bucket_folder.mkdir(parents=True, exist_ok=True)
-            for blob in storage.bucket().list_blobs():
-                file_path: Path = self._temporary_bucket_folder / blob.name
-                file_path.parent.mkdir(parents=True, exist_ok=True)
-                blob.download_to_filename(str(file_path))
+        with instrumentation.phase("restore_tokens"), ThreadPoolExecutor(
+            max_workers=_max_concurrent_requests
+        ) as executor:
+            errors = dict(zip(tokens, executor.map(restore, tokens)))
+
+        restored = [token for token, error in errors.items() if error is None]
+        if not dry_run:
+            print(f"{len(restored)} out of {len(tokens)} classes were restored")
+        for error in errors.values():
+            if error is not None:
+                print(f"    {error}")
+        return restored
+
+    def load_archives(self) -> None:
+        """
+        Adds the archived classes to the loaded database, so they are read (e.g. exported) like the other classes. The
+        archives are not restored, the database itself is left untouched.
+        """
+        with instrumentation.phase("load_archives"):
+            archives = self._download_token_archives()
+        self._database = ArchivedDatabase(self.database, archives)
+        self._index = None
+        print(f"{len(archives)} archived classes were added to the database")
+
+    def _download_token_archives(self) -> list[dict]:
+        blobs = list(storage.bucket().list_blobs(prefix=token_archive_prefix))
+        with ThreadPoolExecutor(max_workers=_max_concurrent_requests) as executor:
+            archives = list(executor.map(lambda blob: decode_token_archive(blob.download_as_bytes()), blobs))
+        instrumentation.count("storage.blobs_downloaded", len(blobs))
+        return archives
 
     def _full_database(self) -> Any:
-        return db.reference(f"/{_database_version}").get()
+        return _record_read(db.reference(f"/{_database_version}").get())
+
+    def _incremental_database(self) -> tuple[dict, dict[str, str]]:
+        """
+        Fetches the database in parallel, one subtree at a time for the large sections split by class (e.g.
+        "answers/{token}", listed with shallow queries) and one section at a time for the others (e.g. "users"). The
+        parts whose ETag did not change since the last sync are taken from the local snapshot instead of being
+        downloaded again.
+        """
+        snapshot = {}
+        etags = {}
+        if self._temporary_database_filepath.exists() and self._temporary_etags_filepath.exists():
+            snapshot = Snapshot(self._temporary_database_filepath)
+            with open(self._temporary_etags_filepath, "r", encoding="utf-8") as f:
+                etags = json.load(f)
+
+        root = db.reference(f"/{_database_version}")
+        with ThreadPoolExecutor(max_workers=_max_concurrent_requests) as executor:
+            nodes = list((_record_read(root.get(shallow=True)) or {}).keys())
+            split_nodes = [node for node in nodes if node in _split_sections]
+            keys = executor.map(
+                lambda node: list((_record_read(root.child(node).get(shallow=True)) or {}).keys()), split_nodes
+            )
+            keys_by_node = dict(zip(split_nodes, keys))
+            # A None key stands for the whole section
+            paths = [(node, key) for node in nodes for key in keys_by_node.get(node, [None])]
+
+            def cached(node: str, key: str | None) -> Any:
+                if node not in snapshot:
+                    return None
+                if key is None:
+                    return snapshot[node]
+                return snapshot[node].get(key) if isinstance(snapshot[node], dict) else None
+
+            def fetch(path: tuple[str, str | None]) -> tuple[bool, Any, str]:
+                node, key = path
+                reference = root.child(node) if key is None else root.child(node).child(key)
+                etag = etags.get(_etag_key(node, key))
+                if etag is None or cached(node, key) is None:
+                    value, etag = reference.get(etag=True)
+                    return True, _record_read(value), etag
+                changed, value, etag = reference.get_if_changed(etag)
+                return changed, _record_read(value), etag
+
+            results = list(executor.map(fetch, paths))
+
+        data = {node: {} for node in nodes}
+        new_etags = {}
+        changed_count = 0
+        for (node, key), (changed, value, etag) in zip(paths, results):
+            value = value if changed else cached(node, key)
+            if key is None:
+                data[node] = value
+            else:
+                data[node][key] = value
+            # An unchanged part comes back without an ETag, its previous one is still valid
+            new_etags[_etag_key(node, key)] = etag if changed else etags[_etag_key(node, key)]
+            changed_count += changed
+        print(f"{changed_count} out of {len(paths)} subtrees were fetched, the others were unchanged")
+        return data, new_etags
 
     def _initialize_database(self):
         # Initialize Firebase Admin SDK
@@ -179,3 +577,15 @@ class FirebaseController:
             cred,
             {"databaseURL": self._database_url, "storageBucket": self._bucket_url},
         )
+
+
+def _etag_key(node: str, key: str | None) -> str:
+    return node if key is None else f"{node}/{key}"
+
+
+def _record_read(value: Any) -> Any:
+    """Counts a read of the database, the bytes are estimated from the compact JSON of [value] when instrumenting"""
+    instrumentation.count("rtdb.reads")
+    if instrumentation.enabled and value is not None:
+        instrumentation.count("rtdb.bytes_received", len(json.dumps(value, separators=(",", ":"))))
+    return value
@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import pstats
+import threading
+import time
+from typing import Iterator
+
+
+class Instrumentation:
+    """
+    Collects the time spent in each phase of an admin script along with counters (database calls, bytes, blobs...).
+    Phases can be nested, their names are then joined with "/" (e.g. "load_database/download"). The nesting is tracked
+    per thread, so a phase opened in a worker thread is reported at the top level.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._phases: dict[str, dict] = {}
+        self._counters: dict[str, int] = {}
+        self._started_at = time.perf_counter()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._phases = {}
+            self._counters = {}
+            self._started_at = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        stack = self._local.stack
+        stack.append(name)
+        full_name = "/".join(stack)
+
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - tic
+            stack.pop()
+            with self._lock:
+                entry = self._phases.setdefault(full_name, {"calls": 0, "seconds": 0.0})
+                entry["calls"] += 1
+                entry["seconds"] += elapsed
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "total_seconds": time.perf_counter() - self._started_at,
+                "phases": {name: dict(entry) for name, entry in self._phases.items()},
+                "counters": dict(self._counters),
+            }
+
+    def print_report(self) -> None:
+        report = self.report()
+        print(f"Total time: {report['total_seconds']:.2f}s")
+        for name, entry in report["phases"].items():
+            print(f"    {name:<50} {entry['seconds']:>9.2f}s ({entry['calls']} calls)")
+        for name, value in sorted(report["counters"].items()):
+            print(f"    {name:<50} {value:>10}")
+
+    def save_report(self, filepath: Path) -> None:
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+instrumentation = Instrumentation()
+
+
+@contextmanager
+def instrumented_script(name: str, report_folder: Path) -> Iterator[Instrumentation]:
+    """
+    Runs an admin script under the instrumentation. If INSTRUMENTATION_REPORT is "true", the report is printed and
+    saved as JSON in [report_folder] when the script ends. If PROFILER is "cprofile" or "pyinstrument", the script is
+    also profiled and the profile is saved next to the report.
+    """
+    instrumentation.enabled = os.getenv("INSTRUMENTATION_REPORT", "false").lower() == "true"
+    instrumentation.reset()
+    filepath_stem = report_folder / f"{name}_{datetime.now():%Y%m%d_%H%M%S}"
+
+    profiler_name = os.getenv("PROFILER", "").lower()
+    profiler = None
+    if profiler_name == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profiler_name == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("PROFILER=pyinstrument requires pyinstrument, install it with `pip install pyinstrument`")
+
+        profiler = Profiler()
+        profiler.start()
+    elif profiler_name != "":
+        raise ValueError(f"Unknown profiler {profiler_name}, expected cprofile or pyinstrument")
+
+    try:
+        with instrumentation.phase(name):
+            yield instrumentation
+    finally:
+        if profiler is not None:
+            report_folder.mkdir(parents=True, exist_ok=True)
+            if profiler_name == "cprofile":
+                profiler.disable()
+                profiler.dump_stats(filepath_stem.with_suffix(".prof"))
+                pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
+            else:
+                profiler.stop()
+                filepath_stem.with_suffix(".html").write_text(profiler.output_html(), encoding="utf-8")
+            print(f"The profile was saved in {report_folder}")
+
+        if instrumentation.enabled:
+            instrumentation.print_report()
+            instrumentation.save_report(filepath_stem.with_suffix(".json"))
+            print(f"The instrumentation report was saved to {filepath_stem.with_suffix('.json')}")
@@ -0,0 +1,132 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import io
+import os
+from pathlib import Path
+import re
+import zipfile
+
+from .export_writers import ExportWriter, export_writer
+
+_photo_path_pattern = re.compile(r"^/?([^/]+)/([^/]+\.[A-Za-z0-9]+)$")
+_thumbnail_extensions = {"jpeg": ".jpg", "webp": ".webp"}
+
+
+class PhotoBundleWriter(ExportWriter):
+    """
+    Writes the rows in a spreadsheet inside a zip bundle, along with a thumbnail of every photo the rows refer to. Each
+    row ends with the isPhotoUrl flag of its message, which is not written in the spreadsheet. A flagged row refers to
+    a photo when its [photo_column] cell holds the storage path of a photo (e.g. "/{user_id}/{name}.jpg") found in
+    [storage_folder], the mirror made by FirebaseController.download_storage. The path of the thumbnail in the bundle
+    (e.g. "photos/{user_id}/{name}.jpg.webp") is then written in an extra "Photo" column.
+
+    The thumbnails are made by a pool of [workers] processes and are added to the bundle as soon as they are ready, so
+    neither the photos nor the thumbnails are ever all held in memory.
+    """
+
+    def __init__(
+        self,
+        filepath: Path,
+        columns: list[str],
+        storage_folder: Path,
+        photo_column: int,
+        sheet_format: str = "xlsx",
+        thumbnail_size: int = 512,
+        thumbnail_format: str = "jpeg",
+        workers: int | None = None,
+    ):
+        super().__init__(filepath=filepath, columns=columns)
+        try:
+            import PIL
+        except ImportError:
+            raise ImportError("Exporting the photos requires Pillow, install it with `pip install pillow`")
+        if thumbnail_format not in _thumbnail_extensions:
+            raise ValueError(f"Unsupported thumbnail format {thumbnail_format}, expected jpeg or webp")
+
+        self._storage_folder = storage_folder
+        self._photo_column = photo_column
+        self._thumbnail_size = thumbnail_size
+        self._thumbnail_format = thumbnail_format
+        self._workers = os.cpu_count() if workers is None else workers
+
+        self._sheet_name = f"discussions.{sheet_format}"
+        self._sheet_filepath = filepath.with_name(f"{filepath.stem}_{self._sheet_name}")
+        self._sheet = export_writer(self._sheet_filepath, columns=columns + ["Photo"])
+        self._bundle = zipfile.ZipFile(filepath, "w")
+        self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        self._pending: deque[tuple[str, Future]] = deque()
+        self._thumbnail_names: set[str] = set()
+        self._missing_count = 0
+        self._failures: list[str] = []
+
+    def write_row(self, row: list) -> None:
+        *cells, is_photo = row
+        self._sheet.write_row(cells + [self._thumbnail_name(cells[self._photo_column]) if is_photo else ""])
+
+    def close(self) -> None:
+        try:
+            while self._pending:
+                self._write_oldest_thumbnail()
+            self._sheet.close()
+            self._bundle.write(self._sheet_filepath, arcname=self._sheet_name, compress_type=zipfile.ZIP_DEFLATED)
+        finally:
+            self._executor.shutdown()
+            self._bundle.close()
+            self._sheet_filepath.unlink(missing_ok=True)
+
+        print(f"{len(self._thumbnail_names) - len(self._failures)} photos were added to {self._filepath}")
+        if self._missing_count:
+            print(f"{self._missing_count} photos were not found in {self._storage_folder}, download the storage first")
+        if self._failures:
+            print(f"{len(self._failures)} photos could not be read (e.g. {self._failures[0]})")
+
+    def _thumbnail_name(self, cell) -> str:
+        """Schedules the thumbnail of the photo in [cell], if any, and returns its path in the bundle"""
+        match = _photo_path_pattern.match(cell) if isinstance(cell, str) else None
+        if match is None:
+            return ""
+
+        # The source extension is kept, so "x.png" and "x.jpg" of a same user get their own thumbnails
+        user_id, name = match.groups()
+        thumbnail_name = f"photos/{user_id}/{name}{_thumbnail_extensions[self._thumbnail_format]}"
+        if thumbnail_name in self._thumbnail_names:
+            return thumbnail_name
+
+        source = self._storage_folder / cell.lstrip("/")
+        if not source.is_file():
+            self._missing_count += 1
+            return ""
+
+        self._thumbnail_names.add(thumbnail_name)
+        self._pending.append(
+            (
+                thumbnail_name,
+                self._executor.submit(_thumbnail, source, self._thumbnail_size, self._thumbnail_format),
+            )
+        )
+
+        # Only keep a few thumbnails per worker in flight, the finished ones are written as the rows go
+        while len(self._pending) > self._workers * 4 or (self._pending and self._pending[0][1].done()):
+            self._write_oldest_thumbnail()
+        return thumbnail_name
+
+    def _write_oldest_thumbnail(self) -> None:
+        thumbnail_name, future = self._pending.popleft()
+        try:
+            data = future.result()
+        except Exception:
+            self._failures.append(thumbnail_name)
+            return
+        # The images are already compressed, deflating them again would only cost time
+        self._bundle.writestr(thumbnail_name, data, compress_type=zipfile.ZIP_STORED)
+
+
+def _thumbnail(source: Path, size: int, thumbnail_format: str) -> bytes:
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.convert("RGB").save(output, format=thumbnail_format.upper(), quality=80)
+    return output.getvalue()
@@ -0,0 +1,181 @@
+from contextlib import closing
+from pathlib import Path
+import sqlite3
+from typing import Any, Callable, Iterator
+
+from .snapshot import Snapshot
+
+_schema = """
+CREATE TABLE IF NOT EXISTS fingerprints (section TEXT PRIMARY KEY, fingerprint TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, email TEXT, avatar TEXT, creation_date TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tokens (token TEXT PRIMARY KEY, teacher_id TEXT);
+CREATE INDEX IF NOT EXISTS tokens_teacher_id ON tokens (teacher_id);
+
+CREATE TABLE IF NOT EXISTS memberships (token TEXT, user_id TEXT, PRIMARY KEY (token, user_id));
+CREATE INDEX IF NOT EXISTS memberships_user_id ON memberships (user_id);
+
+CREATE TABLE IF NOT EXISTS questions (
+    teacher_id TEXT, question_id TEXT, section INTEGER, text TEXT, creation_timestamp INTEGER,
+    PRIMARY KEY (teacher_id, question_id)
+);
+
+CREATE TABLE IF NOT EXISTS answers (
+    token TEXT, student_id TEXT, question_id TEXT, created_by_id TEXT, is_active INTEGER, is_validated INTEGER,
+    PRIMARY KEY (token, student_id, question_id)
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    token TEXT, student_id TEXT, question_id TEXT, message_id TEXT, creator_id TEXT, creation_timestamp INTEGER,
+    is_photo_url INTEGER, text TEXT,
+    PRIMARY KEY (token, student_id, question_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS messages_creation_timestamp ON messages (creation_timestamp);
+"""
+
+
+class QueryEngine:
+    """
+    Indexed SQLite copy of a database snapshot with the tables users, tokens (the teaching tokens), memberships (the
+    users connected to a token), questions, answers and messages (the discussions), so the analyses can be written as
+    SQL queries instead of nested loops over the tree.
+    """
+
+    def __init__(self, filepath: Path):
+        self._filepath = filepath
+        self._filepath.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self._filepath)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(_schema)
+
+    def refresh(self, snapshot: Snapshot) -> None:
+        """Rebuilds the tables whose section of [snapshot] changed since the last refresh"""
+        fingerprints = dict(self._connection.execute("SELECT section, fingerprint FROM fingerprints").fetchall())
+        for section, tables in _tables_by_section.items():
+            fingerprint = snapshot.fingerprint(section) if section in snapshot else ""
+            if fingerprints.get(section) == fingerprint:
+                continue
+
+            print(f"Rebuilding the query engine tables: {', '.join(tables)}...")
+            data = snapshot[section] if section in snapshot else {}
+            with self._connection:
+                for table, rows in tables.items():
+                    self._connection.execute(f"DELETE FROM {table}")
+                    self._connection.executemany(_insert_statements[table], rows(data))
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO fingerprints (section, fingerprint) VALUES (?, ?)", (section, fingerprint)
+                )
+
+    def query(self, sql: str, parameters: tuple | dict = ()) -> Iterator[sqlite3.Row]:
+        """Yields the rows as they are read, so a large result is never held in memory at once"""
+        with closing(self._connection.execute(sql, parameters)) as cursor:
+            yield from cursor
+
+    def dataframe(self, sql: str, parameters: tuple | dict = ()):
+        """Same as query, with the result read column by column in a pandas DataFrame"""
+        import pandas as pd
+
+        return pd.read_sql_query(sql, self._connection, params=parameters)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def _dict_items(node: Any) -> Iterator[tuple[str, dict]]:
+    if not isinstance(node, dict):
+        return
+    for key, value in node.items():
+        if isinstance(value, dict):
+            yield key, value
+
+
+def _users_rows(users: dict) -> Iterator[tuple]:
+    for _, user in _dict_items(users):
+        if "firstName" not in user:
+            continue
+        yield (
+            user["id"],
+            user.get("firstName"),
+            user.get("lastName"),
+            user.get("email"),
+            user.get("avatar"),
+            user.get("creationDate"),
+        )
+
+
+def _tokens_rows(tokens: dict) -> Iterator[tuple]:
+    for token, node in _dict_items(tokens):
+        if "metadata" not in node:
+            continue
+        metadata = node["metadata"]
+        yield token, metadata.get("createdBy") if isinstance(metadata, dict) else None
+
+
+def _memberships_rows(tokens: dict) -> Iterator[tuple]:
+    for token, node in _dict_items(tokens):
+        for user_id in node.get("connectedUsers") or {}:
+            yield token, user_id
+
+
+def _questions_rows(questions: dict) -> Iterator[tuple]:
+    for teacher_id, teacher_questions in _dict_items(questions):
+        for question_id, question in _dict_items(teacher_questions):
+            yield (
+                teacher_id,
+                question_id,
+                question.get("section"),
+                question.get("text"),
+                question.get("creationTimeStamp"),
+            )
+
+
+def _answers_rows(answers: dict) -> Iterator[tuple]:
+    for token, students in _dict_items(answers):
+        for student_id, student_answers in _dict_items(students):
+            for question_id, answer in _dict_items(student_answers):
+                yield (
+                    token,
+                    student_id,
+                    question_id,
+                    answer.get("createdById"),
+                    answer.get("isActive"),
+                    answer.get("isValidated"),
+                )
+
+
+def _messages_rows(answers: dict) -> Iterator[tuple]:
+    for token, students in _dict_items(answers):
+        for student_id, student_answers in _dict_items(students):
+            for question_id, answer in _dict_items(student_answers):
+                for message_id, message in _dict_items(answer.get("discussion")):
+                    yield (
+                        token,
+                        student_id,
+                        question_id,
+                        message_id,
+                        message.get("creatorId"),
+                        message.get("creationTimeStamp"),
+                        message.get("isPhotoUrl"),
+                        message.get("text"),
+                    )
+
+
+# Each section of the snapshot feeds one or more tables
+_tables_by_section: dict[str, dict[str, Callable[[dict], Iterator[tuple]]]] = {
+    "users": {"users": _users_rows},
+    "tokens": {"tokens": _tokens_rows, "memberships": _memberships_rows},
+    "questions": {"questions": _questions_rows},
+    "answers": {"answers": _answers_rows, "messages": _messages_rows},
+}
+
+_insert_statements = {
+    "users": "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)",
+    "tokens": "INSERT OR REPLACE INTO tokens VALUES (?, ?)",
+    "memberships": "INSERT OR REPLACE INTO memberships VALUES (?, ?)",
+    "questions": "INSERT OR REPLACE INTO questions VALUES (?, ?, ?, ?, ?)",
+    "answers": "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+    "messages": "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+}
@@ -0,0 +1,84 @@
+from contextlib import closing
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Any, Iterator, Mapping
+import zlib
+
+from .instrumentation import instrumentation
+
+
+class Snapshot(Mapping[str, Any]):
+    """
+    Local copy of the database stored as a SQLite file holding one zlib-compressed JSON section per top-level node
+    (e.g. "users", "tokens"). A section is only read and decoded the first time it is accessed, so a script that only
+    needs the users never pays for the answers.
+    """
+
+    def __init__(self, filepath: Path):
+        self._filepath = filepath
+        self._sections: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            self._names = tuple(name for (name,) in connection.execute("SELECT name FROM sections ORDER BY name"))
+
+    @staticmethod
+    def write(filepath: Path, data: Mapping[str, Any]) -> None:
+        # Write to a temporary file first so an interrupted write never replaces a valid snapshot
+        temporary_filepath = filepath.with_name(filepath.name + ".tmp")
+        temporary_filepath.unlink(missing_ok=True)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        connection = sqlite3.connect(temporary_filepath)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE sections (name TEXT PRIMARY KEY, payload BLOB NOT NULL)")
+                connection.executemany(
+                    "INSERT INTO sections (name, payload) VALUES (?, ?)",
+                    (
+                        (name, zlib.compress(json.dumps(section, separators=(",", ":")).encode("utf-8")))
+                        for name, section in data.items()
+                    ),
+                )
+        finally:
+            connection.close()
+        os.replace(temporary_filepath, filepath)
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._names:
+            raise KeyError(name)
+
+        with self._lock:
+            if name not in self._sections:
+                with instrumentation.phase("decode_snapshot"):
+                    with self._connect() as connection:
+                        query = "SELECT payload FROM sections WHERE name = ?"
+                        (payload,) = connection.execute(query, (name,)).fetchone()
+                    self._sections[name] = json.loads(zlib.decompress(payload))
+                instrumentation.count("snapshot.bytes_decoded", len(payload))
+            return self._sections[name]
+
+    def fingerprint(self, name: str) -> str:
+        """Hash of the stored section, which changes whenever its content does, without decoding it"""
+        with self._connect() as connection:
+            row = connection.execute("SELECT payload FROM sections WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return hashlib.sha1(row[0]).hexdigest()
+
+    def __contains__(self, name: object) -> bool:
+        # Mapping.__contains__ would decode the section through __getitem__
+        return name in self._names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per read keeps the snapshot usable from any thread
+        return closing(sqlite3.connect(f"{self._filepath.resolve().as_uri()}?mode=ro", uri=True))
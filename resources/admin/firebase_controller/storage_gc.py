@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import re
+import threading
+import time
+from typing import Any, Mapping
+
+from .instrumentation import instrumentation
+from .token_archives import archive_prefix
+
+# The app uploads the photos of the discussions to "{user_id}/{name}", the other blobs (e.g. the archives of the
+# classes) are never collected
+_photo_blob_pattern = re.compile(r"^[^/]+/[^/]+$")
+
+
+def referenced_storage_paths(answers: Mapping[str, Any]) -> set[str]:
+    """Storage paths (relative to the bucket) of every photo still posted in a discussion of the [answers] tree"""
+    paths = set()
+    for students in answers.values():
+        if not isinstance(students, dict):
+            continue
+        for student_answers in students.values():
+            if not isinstance(student_answers, dict):
+                continue
+            for answer in student_answers.values():
+                discussion = answer.get("discussion") if isinstance(answer, dict) else None
+                if not isinstance(discussion, dict):
+                    continue
+                for message in discussion.values():
+                    if isinstance(message, dict) and message.get("isPhotoUrl") and isinstance(message.get("text"), str):
+                        paths.add(message["text"].lstrip("/"))
+    return paths
+
+
+class StorageGarbageCollector:
+    """
+    Deletes the photos of the bucket that no discussion refers to anymore. The bucket is listed one page at a time and
+    compared to [referenced_paths]. The blobs created less than [grace_period] ago are always kept, since their message
+    may not be written yet (or may be missing from the database snapshot the paths come from). The orphans are deleted
+    by [max_workers] threads, at most [max_deletes_per_second] per second.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        referenced_paths: set[str],
+        grace_period: timedelta = timedelta(days=7),
+        max_workers: int = 16,
+        max_deletes_per_second: float = 50.0,
+        page_size: int = 1000,
+    ):
+        self._bucket = bucket
+        self._referenced_paths = referenced_paths
+        self._grace_period = grace_period
+        self._max_workers = max_workers
+        self._delete_interval = 1.0 / max_deletes_per_second
+        self._page_size = page_size
+
+        self._lock = threading.Lock()
+        self._next_delete_at = 0.0
+
+    def collect(self, dry_run: bool = True) -> dict:
+        """Deletes the orphans, or only lists them if [dry_run], and returns a report of what was found"""
+        created_before = datetime.now(timezone.utc) - self._grace_period
+        report = {
+            "scanned": 0,
+            "referenced": 0,
+            "recent": 0,
+            "not_photos": 0,
+            "orphans": [],
+            "orphan_bytes": 0,
+            "deleted": 0,
+            "failures": [],
+        }
+
+        # The semaphore prevents the listing from queuing up the whole bucket ahead of the deletions
+        in_flight = threading.BoundedSemaphore(self._max_workers * 2)
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for page in self._bucket.list_blobs(page_size=self._page_size).pages:
+                for blob in page:
+                    report["scanned"] += 1
+                    instrumentation.count("storage.blobs_listed")
+                    if blob.name.startswith(archive_prefix) or not _photo_blob_pattern.match(blob.name):
+                        report["not_photos"] += 1
+                    elif blob.name in self._referenced_paths:
+                        report["referenced"] += 1
+                    elif blob.time_created is None or blob.time_created > created_before:
+                        report["recent"] += 1
+                    else:
+                        report["orphans"].append(blob.name)
+                        report["orphan_bytes"] += blob.size or 0
+                        if not dry_run:
+                            in_flight.acquire()
+                            future = executor.submit(self._delete, blob, report)
+                            future.add_done_callback(lambda _: in_flight.release())
+                print(f"Scanned {report['scanned']} files, found {len(report['orphans'])} orphans so far...")
+
+        return report
+
+    def _delete(self, blob, report: dict) -> None:
+        self._wait_for_rate_limit()
+        try:
+            blob.delete()
+        except Exception:
+            with self._lock:
+                report["failures"].append(blob.name)
+            return
+        with self._lock:
+            report["deleted"] += 1
+        instrumentation.count("storage.blobs_deleted")
+
+    def _wait_for_rate_limit(self) -> None:
+        # Each deletion reserves the next free slot, so the deletions are evenly spread whatever the number of threads
+        with self._lock:
+            now = time.monotonic()
+            delete_at = max(now, self._next_delete_at)
+            self._next_delete_at = delete_at + self._delete_interval
+        time.sleep(max(0.0, delete_at - now))
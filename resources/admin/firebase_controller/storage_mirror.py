@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+from .instrumentation import instrumentation
+
+
+class StorageMirror:
+    """
+    Mirrors a storage bucket into a local folder. The blobs are downloaded by a bounded pool of threads and recorded
+    in a manifest as soon as they are on disk, so a later sync (including one resuming after a crash) only downloads
+    the blobs that are missing or that changed in the bucket.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        folder: Path,
+        max_workers: int = 16,
+        report_interval: float = 5.0,
+        manifest_flush_interval: int = 100,
+    ):
+        self._bucket = bucket
+        self._folder = folder
+        self._manifest_filepath = folder / ".manifest.json"
+        self._max_workers = max_workers
+        self._report_interval = report_interval
+        self._manifest_flush_interval = manifest_flush_interval
+
+        self._lock = threading.RLock()
+        self._manifest: dict[str, dict] = {}
+        self._downloaded_count = 0
+        self._downloaded_bytes = 0
+        self._skipped_count = 0
+        self._failures: list[str] = []
+        self._started_at = 0.0
+        self._last_report_at = 0.0
+
+    def sync(self, force_download: bool = False) -> None:
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._manifest = {} if force_download else self._load_manifest()
+        self._failures = []
+        self._started_at = self._last_report_at = time.perf_counter()
+
+        # The semaphore prevents the listing from queuing up the whole bucket ahead of the downloads
+        in_flight = threading.BoundedSemaphore(self._max_workers * 2)
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for blob in self._bucket.list_blobs():
+                if blob.name.endswith("/"):
+                    continue
+                if self._is_up_to_date(blob):
+                    self._skipped_count += 1
+                    continue
+
+                in_flight.acquire()
+                future = executor.submit(self._download, blob)
+                future.add_done_callback(lambda _: in_flight.release())
+                self._report_if_due()
+
+        self._save_manifest()
+        self._report()
+        instrumentation.count("storage.blobs_downloaded", self._downloaded_count)
+        instrumentation.count("storage.bytes_downloaded", self._downloaded_bytes)
+        instrumentation.count("storage.blobs_skipped", self._skipped_count)
+
+        if self._failures:
+            raise RuntimeError(
+                f"{len(self._failures)} files could not be downloaded (e.g. {self._failures[0]}), sync again to resume"
+            )
+
+    def _is_up_to_date(self, blob) -> bool:
+        entry = self._manifest.get(blob.name)
+        if entry != _manifest_entry(blob):
+            return False
+        file_path = self._folder / blob.name
+        return file_path.exists() and file_path.stat().st_size == blob.size
+
+    def _download(self, blob) -> None:
+        file_path = self._folder / blob.name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Download next to the destination and move it once complete so a crash never leaves a truncated file behind
+        partial_file_path = file_path.with_name(file_path.name + ".part")
+        try:
+            blob.download_to_filename(str(partial_file_path))
+            os.replace(partial_file_path, file_path)
+        except Exception:
+            partial_file_path.unlink(missing_ok=True)
+            with self._lock:
+                self._failures.append(blob.name)
+            return
+
+        with self._lock:
+            self._manifest[blob.name] = _manifest_entry(blob)
+            self._downloaded_count += 1
+            self._downloaded_bytes += blob.size or 0
+            if self._downloaded_count % self._manifest_flush_interval == 0:
+                self._save_manifest()
+
+    def _load_manifest(self) -> dict[str, dict]:
+        if not self._manifest_filepath.exists():
+            return {}
+        with open(self._manifest_filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self) -> None:
+        with self._lock:
+            temporary_filepath = self._manifest_filepath.with_suffix(".tmp")
+            with open(temporary_filepath, "w", encoding="utf-8") as f:
+                json.dump(self._manifest, f)
+            os.replace(temporary_filepath, self._manifest_filepath)
+
+    def _report_if_due(self) -> None:
+        if time.perf_counter() - self._last_report_at >= self._report_interval:
+            self._report()
+
+    def _report(self) -> None:
+        self._last_report_at = time.perf_counter()
+        elapsed = max(self._last_report_at - self._started_at, 1e-9)
+        print(
+            f"Downloaded {self._downloaded_count} files ({self._downloaded_bytes / 1e6:.1f} MB), "
+            f"skipped {self._skipped_count} up-to-date files - "
+            f"{self._downloaded_count / elapsed:.1f} files/s, {self._downloaded_bytes / 1e6 / elapsed:.2f} MB/s"
+        )
+
+
+def _manifest_entry(blob) -> dict:
+    return {"size": blob.size, "md5": blob.md5_hash, "generation": blob.generation}
@@ -0,0 +1,156 @@
+import gzip
+import json
+from typing import Any, Iterator, Mapping
+
+from .database_index import _section
+
+# Storage prefix of everything the admin tools archive, the app never reads nor writes there
+archive_prefix = "archives/"
+token_archive_prefix = f"{archive_prefix}tokens/"
+
+
+def token_archive_name(token: str) -> str:
+    return f"{token_archive_prefix}{token}.json.gz"
+
+
+def last_activity(tree: Mapping[str, Any], token: str) -> int | None:
+    """
+    Latest activity of a class in microseconds since the epoch: its newest message or, for a class without messages,
+    the creation of the token by the teacher. None if the class has neither.
+    """
+    latest = None
+    students = _section(tree, "answers").get(token)
+    for answers in students.values() if isinstance(students, dict) else ():
+        for answer in answers.values() if isinstance(answers, dict) else ():
+            discussion = answer.get("discussion") if isinstance(answer, dict) else None
+            for message in discussion.values() if isinstance(discussion, dict) else ():
+                timestamp = message.get("creationTimeStamp") if isinstance(message, dict) else None
+                if isinstance(timestamp, int) and (latest is None or timestamp > latest):
+                    latest = timestamp
+    if latest is not None:
+        return latest
+
+    # The token records its creation in milliseconds (ServerValue.timestamp)
+    for _, created in _created_entries(tree, token):
+        if isinstance(created.get("createdAt"), int):
+            return created["createdAt"] * 1000
+    return None
+
+
+def archivable_tokens(tree: Mapping[str, Any], cutoff: int) -> list[str]:
+    """
+    Tokens of the classes without any activity since [cutoff] (in microseconds since the epoch). The class a teacher is
+    currently using (isActive) is never archived, whatever its last activity.
+    """
+    tokens = set(_section(tree, "answers")) | set(_section(tree, "tokens"))
+    tokens.discard("existing")
+
+    archivable = []
+    for token in sorted(tokens):
+        if any(created.get("isActive") for _, created in _created_entries(tree, token)):
+            continue
+        activity = last_activity(tree, token)
+        if activity is not None and activity < cutoff:
+            archivable.append(token)
+    return archivable
+
+
+def plan_token_archives(tree: Mapping[str, Any], tokens: list[str]) -> dict[str, dict[str, Any]]:
+    """
+    Lists, for each token, every path (relative to the database version) holding data of the class with its value: the
+    class itself, the answers of its students and the references the users keep to it. The paths can be removed with
+    a multi-location update and the archive can be restored as is with another one. tokens/existing is left untouched so
+    an archived token is never handed out again.
+    """
+    plans = {token: {} for token in tokens}
+    for token, plan in plans.items():
+        for section in ("answers", "tokens"):
+            value = _section(tree, section).get(token)
+            if value is not None:
+                plan[f"{section}/{token}"] = value
+
+    # A single pass over the users finds the references to all the tokens
+    for user_id, user in _section(tree, "users").items():
+        user_tokens = user.get("tokens") if isinstance(user, dict) else None
+        if not isinstance(user_tokens, dict):
+            continue
+        for kind in ("connected", "created"):
+            references = user_tokens.get(kind)
+            for token in references if isinstance(references, dict) else ():
+                if token in plans:
+                    plans[token][f"users/{user_id}/tokens/{kind}/{token}"] = references[token]
+    return plans
+
+
+def encode_token_archive(token: str, paths: dict[str, Any], archived_at: int) -> bytes:
+    archive = {"token": token, "archivedAt": archived_at, "paths": paths}
+    return gzip.compress(json.dumps(archive, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_token_archive(data: bytes) -> dict:
+    return json.loads(gzip.decompress(data))
+
+
+class ArchivedDatabase(Mapping[str, Any]):
+    """
+    Read-only view of the live tree in which the archived classes are restored, so they are exported like any other
+    class. A section is only merged the first time it is accessed, and only the nodes on the path of an archived value
+    are copied, the live tree itself is never modified.
+    """
+
+    def __init__(self, live: Mapping[str, Any], archives: list[dict]):
+        self._live = live
+        self._paths_by_section: dict[str, list[tuple[list[str], Any]]] = {}
+        for archive in archives:
+            for path, value in archive["paths"].items():
+                section, *parts = path.split("/")
+                self._paths_by_section.setdefault(section, []).append((parts, value))
+        self._sections: dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._sections:
+            paths = self._paths_by_section.get(name)
+            if not paths:
+                return self._live[name]
+
+            section = dict(self._live[name]) if isinstance(self._live.get(name), dict) else {}
+            for parts, value in paths:
+                node = section
+                for part in parts[:-1]:
+                    node[part] = dict(node[part]) if isinstance(node.get(part), dict) else {}
+                    node = node[part]
+                node[parts[-1]] = value
+            self._sections[name] = section
+        return self._sections[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(dict.fromkeys([*self._live, *self._paths_by_section]))
+
+    def __len__(self) -> int:
+        return len(set(self._live) | set(self._paths_by_section))
+
+
+def _created_entries(tree: Mapping[str, Any], token: str) -> Iterator[tuple[str, dict]]:
+    """Yields the teacher id and the users/{teacher}/tokens/created/{token} entry of the teacher who created [token]"""
+    node = _section(tree, "tokens").get(token)
+    metadata = node.get("metadata") if isinstance(node, dict) else None
+    teacher_ids = [metadata["createdBy"]] if isinstance(metadata, dict) and "createdBy" in metadata else []
+    if not teacher_ids:
+        # The node of an unregistered token is removed, the teacher is then found through its answers
+        students = _section(tree, "answers").get(token)
+        for answers in students.values() if isinstance(students, dict) else ():
+            for answer in answers.values() if isinstance(answers, dict) else ():
+                if isinstance(answer, dict) and answer.get("createdById"):
+                    teacher_ids = [answer["createdById"]]
+                    break
+            if teacher_ids:
+                break
+
+    users = _section(tree, "users")
+    for teacher_id in teacher_ids:
+        teacher = users.get(teacher_id)
+        user_tokens = teacher.get("tokens") if isinstance(teacher, dict) else None
+        created = user_tokens.get("created") if isinstance(user_tokens, dict) else None
+        entry = created.get(token) if isinstance(created, dict) else None
+        if isinstance(entry, dict):
+            yield teacher_id, entry
@@ -0,0 +1,50 @@
+from .database_index import DatabaseIndex
+
+
+def plan_user_deletion(index: DatabaseIndex, user_id: str) -> dict[str, None]:
+    """
+    Lists every path (relative to the database version) that must be removed to delete [user_id]. The result can be
+    applied as is as a multi-location update.
+    """
+    # Remove the questions this user has registered
+    paths = [f"questions/{user_id}"]
+
+    for token in index.teaching_tokens:
+        is_teacher = index.teacher_id(teaching_token=token) == user_id
+        is_student = user_id in index.student_ids(teaching_token=token)
+        has_answers = bool(index.answers(teaching_token=token, student_id=user_id))
+        if not (is_teacher or is_student or has_answers):
+            # Only the classes of the user are listed, so the plan grows with the user instead of with the database
+            continue
+
+        # Remove the answers associated with that token
+        if has_answers:
+            paths.append(f"answers/{token}/{user_id}")
+
+        # Fix the tokens
+        if is_teacher:
+            # If we are the teacher disconnect all the students
+            for student_id in index.student_ids(teaching_token=token):
+                paths.append(f"users/{student_id}/tokens/connected/{token}")
+                paths.append(f"users/{student_id}/tokens/userWithExtendedPermissions/{user_id}")
+            paths.append(f"tokens/{token}")
+            paths.append(f"tokens/existing/{token}")
+        elif is_student:
+            # Disconnect from the token if we are connected
+            paths.append(f"tokens/{token}/connectedUsers/{user_id}")
+
+    # Remove the user from the users list
+    paths.append(f"users/{user_id}")
+
+    return {path: None for path in _without_nested_paths(paths)}
+
+
+def _without_nested_paths(paths: list[str]) -> list[str]:
+    # A multi-location update cannot contain a path together with one of its ancestors, and deleting the ancestor
+    # already deletes its children
+    kept = set()
+    for path in sorted(set(paths)):
+        parts = path.split("/")
+        if not any("/".join(parts[:i]) in kept for i in range(1, len(parts))):
+            kept.add(path)
+    return [path for path in dict.fromkeys(paths) if path in kept]
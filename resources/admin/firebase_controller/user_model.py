@@ -1,38 +1,34 @@
+from dataclasses import dataclass, field
 from datetime import datetime
 import random
+from typing import Iterable
 
 
+@dataclass(slots=True)
 class UserModel:
-    def __init__(
-        self,
-        id: str,
-        first_name: str,
-        last_name: str,
-        email: str,
-        avatar: str = None,
-        student_notes: dict | None = None,
-        tokens: dict | None = None,
-        terms_and_services_accepted: bool = False,
-        irsst_page_seen: bool = False,
-        has_seen_student_onboarding: bool = False,
-        has_seen_teacher_onboarding: bool = False,
-        creation_date: datetime = None,
-    ):
-        self._id = id
-        self._first_name = first_name
-        self._last_name = last_name
-        self._avatar = random.choice(_available_avatars) if avatar is None else avatar
-        self._creation_date = datetime.now() if creation_date is None else creation_date
-        self._email = email
+    id: str
+    first_name: str
+    last_name: str
+    email: str
+    avatar: str = None
+    student_notes: dict | None = None
+    tokens: dict | None = None
+    terms_and_services_accepted: bool = False
+    irsst_page_seen: bool = False
+    has_seen_student_onboarding: bool = False
+    has_seen_teacher_onboarding: bool = False
+    creation_date: datetime = None
+    change_password: bool = field(default=False, init=False)
 
-        self._student_notes = {} if student_notes is None else student_notes
-        self._tokens = {} if tokens is None else tokens
-
-        self._change_password = False
-        self._irsst_page_seen = irsst_page_seen
-        self._has_seen_student_onboarding = has_seen_student_onboarding
-        self._has_seen_teacher_onboarding = has_seen_teacher_onboarding
-        self._terms_and_services_accepted = terms_and_services_accepted
+    def __post_init__(self):
+        if self.avatar is None:
+            self.avatar = random.choice(_available_avatars)
+        if self.creation_date is None:
+            self.creation_date = datetime.now()
+        if self.student_notes is None:
+            self.student_notes = {}
+        if self.tokens is None:
+            self.tokens = {}
 
     @classmethod
     def empty(cls, id: str, email: str) -> "UserModel":
@@ -40,47 +36,63 @@ class UserModel:
 
     @classmethod
     def from_serialized(cls, data: dict) -> "UserModel":
+        return cls._from_serialized(data, now=datetime.now())
+
+    @classmethod
+    def from_serialized_many(cls, data: Iterable[dict]) -> list["UserModel"]:
+        """Same as from_serialized for many users, the users without a creation date all get the same one"""
+        now = datetime.now()
+        return [cls._from_serialized(user, now=now) for user in data]
+
+    @classmethod
+    def _from_serialized(cls, data: dict, now: datetime) -> "UserModel":
+        creation_date = data.get("creationDate")
         return cls(
             id=data["id"],
             first_name=data["firstName"],
             last_name=data["lastName"],
             email=data["email"],
             avatar=data["avatar"],
-            student_notes=data["studentNotes"] if "studentNotes" in data else None,
-            tokens=data["tokens"] if "tokens" in data else {},
-            terms_and_services_accepted=(
-                data["termsAndServicesAccepted"] if "termsAndServicesAccepted" in data else True
-            ),
-            irsst_page_seen=data["irsstPageSeen"] if "irsstPageSeen" in data else True,
-            has_seen_student_onboarding=(
-                data["hasSeenStudentOnboarding"] if "hasSeenStudentOnboarding" in data else True
-            ),
-            has_seen_teacher_onboarding=(
-                data["hasSeenTeacherOnboarding"] if "hasSeenTeacherOnboarding" in data else True
-            ),
-            creation_date=datetime.fromisoformat(data["creationDate"]) if "creationDate" in data else datetime.now(),
+            student_notes=data.get("studentNotes"),
+            tokens=data.get("tokens", {}),
+            terms_and_services_accepted=data.get("termsAndServicesAccepted", True),
+            irsst_page_seen=data.get("irsstPageSeen", True),
+            has_seen_student_onboarding=data.get("hasSeenStudentOnboarding", True),
+            has_seen_teacher_onboarding=data.get("hasSeenTeacherOnboarding", True),
+            creation_date=now if creation_date is None else datetime.fromisoformat(creation_date),
         )
 
     @property
     def serialized(self) -> dict:
         return {
-            "id": self._id,
-            "firstName": self._first_name,
-            "lastName": self._last_name,
-            "avatar": self._avatar,
-            "creationDate": f"{self._creation_date:%Y-%m-%d}T{self._creation_date:%H:%M:%S.%f}",
-            "email": self._email,
-            "studentNotes": self._student_notes,
-            "tokens": self._tokens,
-            "changePassword": self._change_password,
-            "termsAndServicesAccepted": self._terms_and_services_accepted,
-            "irsstPageSeen": self._irsst_page_seen,
-            "hasSeenStudentOnboarding": self._has_seen_student_onboarding,
-            "hasSeenTeacherOnboarding": self._has_seen_teacher_onboarding,
+            "id": self.id,
+            "firstName": self.first_name,
+            "lastName": self.last_name,
+            "avatar": self.avatar,
+            "creationDate": _serialized_date(self.creation_date),
+            "email": self.email,
+            "studentNotes": self.student_notes,
+            "tokens": self.tokens,
+            "changePassword": self.change_password,
+            "termsAndServicesAccepted": self.terms_and_services_accepted,
+            "irsstPageSeen": self.irsst_page_seen,
+            "hasSeenStudentOnboarding": self.has_seen_student_onboarding,
+            "hasSeenTeacherOnboarding": self.has_seen_teacher_onboarding,
         }
 
+    @staticmethod
+    def serialize_many(users: Iterable["UserModel"]) -> list[dict]:
+        return [user.serialized for user in users]
 
-_available_avatars = [
+
+def _serialized_date(date: datetime) -> str:
+    # Always written with microseconds and without the time zone (e.g. 2025-08-01T00:00:00.000000)
+    if date.tzinfo is None:
+        return date.isoformat(timespec="microseconds")
+    return date.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+_available_avatars = (
     # Faces
     "🐶",
     "🐺",
@@ -105,7 +117,6 @@ _available_avatars = [
     "🐼",
     "🐻‍❄️",
     "🐨",
-    "🐮",
     "🐔",
     "🐤",
     "🐥",
@@ -117,7 +128,6 @@ _available_avatars = [
     "🦇",
     # Wild animals
     "🐗",
-    "🐴",
     "🦓",
     "🦍",
     "🦧",
@@ -131,15 +141,7 @@ _available_avatars = [
     "🦌",
     "🦬",
     # Sea life
-    "🐶",
-    "🐱",
     "🐭",
-    "🐹",
-    "🐰",
-    "🦊",
-    "🐻",
-    "🐼",
-    "🐨",
     "🐟",
     "🐠",
     "🐡",
@@ -184,4 +186,4 @@ _available_avatars = [
     "🦡",
     "🐿️",
     "🦔",
-]
+)
@@ -1,39 +1,57 @@
 import os
 from pathlib import Path
 import re
+import time
 
-from firebase_controller import FirebaseController, UserModel
+from firebase_controller import FirebaseController, UserModel, instrumented_script
+
+
+def _user_model_from_email(uid: str, email: str) -> UserModel:
+    # Try to extract a name from the email
+    match = re.match(r"^(.*)[\.](.*)@.*$", email)
+    if match is None:
+        return UserModel.empty(id=uid, email=email)
+
+    groups = match.groups()
+    if len(groups) != 2:
+        return UserModel.empty(id=uid, email=email)
+
+    first_name = groups[0].capitalize()
+    last_name = groups[1].capitalize()
+    return UserModel(id=uid, first_name=first_name, last_name=last_name, email=email)
 
 
 def main():
     save_folder = Path(__file__).parent / "export"
-    controller = FirebaseController(
-        certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
-        temporary_folder=save_folder,
-        force_refresh=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true",
-        use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
-    )
-
-    for uid in controller.authenticated_users.keys():
-        user = controller.user(uid)
-        if user is not None:
-            continue
-
-        email = controller.authenticated_users[uid]
-        # Try to extract a name from the email
-        match = re.match(r"^(.*)[\.](.*)@.*$", email)
-        if match is None:
-            user_model = UserModel.empty(id=uid, email=email)
-        else:
-            groups = match.groups()
-            if len(groups) != 2:
-                user_model = UserModel.empty(id=uid, email=email)
-            else:
-                first_name = groups[0].capitalize()
-                last_name = groups[1].capitalize()
-                user_model = UserModel(id=uid, first_name=first_name, last_name=last_name, email=email)
-
-        controller.set_user(user_model.serialized)
+    with instrumented_script("fix_missing_users", report_folder=save_folder / "reports"):
+        controller = FirebaseController(
+            certificate_path=Path(__file__).parent / "monstageenimages-firebase-adminsdk-1owio-3a91847821.json",
+            temporary_folder=save_folder,
+            force_refresh=os.getenv("FORCE_DATABASE_FETCHING", "false").lower() == "true",
+            use_emulator=os.getenv("USE_DATABASE_EMULATOR", "false").lower() == "true",
+            incremental_refresh=os.getenv("INCREMENTAL_DATABASE_FETCHING", "false").lower() == "true",
+        )
+
+        # Repair the users page by page so the writes start before all the accounts are listed
+        tic = time.perf_counter()
+        checked_count = 0
+        repaired_count = 0
+        for authenticated_users in controller.authenticated_user_pages():
+            missing_users = UserModel.serialize_many(
+                _user_model_from_email(uid=uid, email=email)
+                for uid, email in authenticated_users.items()
+                if controller.user(uid) is None
+            )
+            controller.set_users(missing_users)
+
+            checked_count += len(authenticated_users)
+            repaired_count += len(missing_users)
+            print(f"Checked {checked_count} authenticated users, repaired {repaired_count} so far...")
+
+        print(
+            f"Repaired {repaired_count} missing users out of {checked_count} authenticated users "
+            f"in {time.perf_counter() - tic:.1f}s"
+        )
 
 
 if __name__ == "__main__":
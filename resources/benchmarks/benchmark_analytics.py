@@ -0,0 +1,39 @@
+from pathlib import Path
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller import FirebaseController
+from firebase_controller.analytics import DiscussionAnalytics
+from harness import measure
+from synthetic_database import database_from_env, write_snapshot
+
+
+def run(tree: dict, folder: Path) -> list[dict]:
+    write_snapshot(tree, folder)
+    controller = FirebaseController.from_snapshot(temporary_folder=folder)
+    controller.load_database()
+    query_engine = controller.query_engine
+
+    # Only measure the flattening, not the decoding of the snapshot
+    analytics = controller.analytics()
+    print(f"Messages: {len(analytics.messages)}")
+
+    def compute_report() -> None:
+        DiscussionAnalytics(analytics.messages).report()
+
+    return [
+        measure("analytics: flatten the tree", lambda: DiscussionAnalytics.from_tree(controller.database)),
+        measure("analytics: read the query engine", lambda: DiscussionAnalytics.from_query_engine(query_engine)),
+        measure("analytics: compute the report", compute_report),
+    ]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        run(database_from_env(), Path(folder))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import json
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+
+_functions_main_filepath = Path(__file__).parents[2] / "functions" / "main.py"
+
+# Run in a fresh interpreter so nothing is already imported, it prints the import time and whether the Admin SDK was
+# initialized by the import or by an invocation that exits early
+_cold_start_script = f"""
+import importlib.util, json, time, types
+tic = time.perf_counter()
+spec = importlib.util.spec_from_file_location("functions_main", {str(_functions_main_filepath)!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+import_seconds = time.perf_counter() - tic
+
+import firebase_admin
+initialized_by_import = bool(firebase_admin._apps)
+# The decorator expects a CloudEvent, the function it wraps takes the parsed event
+module.notify_on_new_message.__wrapped__(types.SimpleNamespace(params={{}}, data={{}}))
+initialized_by_early_exit = bool(firebase_admin._apps)
+print(json.dumps([import_seconds, initialized_by_import, initialized_by_early_exit]))
+"""
+
+
+def run(repeat: int = 5) -> list[dict]:
+    """
+    Imports functions/main.py with the real SDKs in [repeat] fresh interpreters. It fails if the Admin SDK is
+    initialized before an invocation needs it, or if the fastest import exceeds COLD_START_BUDGET_MS.
+    """
+    budget = float(os.getenv("COLD_START_BUDGET_MS", "1000")) / 1000
+    durations = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _cold_start_script], check=True, capture_output=True, text=True
+        ).stdout
+        import_seconds, initialized_by_import, initialized_by_early_exit = json.loads(output.splitlines()[-1])
+        if initialized_by_import or initialized_by_early_exit:
+            raise AssertionError("The Admin SDK must only be initialized by the invocations which use it")
+        durations.append(import_seconds)
+
+    result = {
+        "name": "cold start: import functions/main.py",
+        "repeat": repeat,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+    }
+    print(f"Import of functions/main.py: min {result['min'] * 1000:.0f} ms (budget {budget * 1000:.0f} ms)")
+    if result["min"] > budget:
+        raise AssertionError(f"The import of functions/main.py exceeds its budget of {budget * 1000:.0f} ms")
+    return [result]
+
+
+def main():
+    run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import copy
+from pathlib import Path
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from database_to_excel import build_table, collect_rows, iterate_sorted_rows, query_sorted_rows
+from firebase_controller import FirebaseController
+from firebase_controller.snapshot import Snapshot
+from harness import measure
+from synthetic_database import database_from_env, write_snapshot
+
+
+def run(tree: dict, folder: Path) -> list[dict]:
+    # The messages of the first discussion are all sent within a same second, in the reverse order of their keys
+    tree = copy.deepcopy(tree)
+    answers = next(iter(next(iter(tree["answers"].values())).values()))
+    discussion = next(answer["discussion"] for answer in answers.values() if answer.get("discussion"))
+    second = max(message["creationTimeStamp"] for message in discussion.values()) // 1_000_000 * 1_000_000
+    for offset, message in enumerate(reversed(discussion.values())):
+        message["creationTimeStamp"] = second + offset
+
+    write_snapshot(tree, folder)
+    controller = FirebaseController.from_snapshot(temporary_folder=folder)
+    controller.load_database()
+    rows = collect_rows(controller)
+    print(f"Rows: {len(rows)}")
+
+    results = [
+        measure("database_to_excel: collect the rows", lambda: collect_rows(controller)),
+        measure("database_to_excel: build the table", lambda: build_table(rows)),
+        measure("database_to_excel: stream the sorted rows", lambda: sum(1 for _ in iterate_sorted_rows(controller))),
+    ]
+
+    def reset_query_engine() -> None:
+        (folder / "firebase_query.sqlite").unlink(missing_ok=True)
+        controller._query_engine = None
+
+    results.append(measure("query engine: build", lambda: controller.query_engine, setup=reset_query_engine))
+    results.append(
+        measure("query engine: query the sorted rows", lambda: sum(1 for _ in query_sorted_rows(controller)))
+    )
+
+    # Nothing changed since the query engine was built, so refreshing it must not decode any section
+    snapshot = Snapshot(controller._temporary_database_filepath)
+    results.append(measure("query engine: refresh without changes", lambda: controller.query_engine.refresh(snapshot)))
+    if snapshot._sections:
+        raise AssertionError(f"A refresh without changes decoded the sections {sorted(snapshot._sections)}")
+
+    # Every mode must produce the same table, including the order of the messages of a same second
+    table = build_table(collect_rows(controller)).values.tolist()
+    if list(iterate_sorted_rows(controller)) != table:
+        raise AssertionError("The streamed rows differ from the table")
+    if list(query_sorted_rows(controller)) != table:
+        raise AssertionError("The rows of the query engine differ from the table")
+    return results
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        run(database_from_env(), Path(folder))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller import DatabaseIndex
+from firebase_controller.user_deletion import plan_user_deletion
+from harness import measure
+from synthetic_database import database_from_env
+
+
+def run(tree: dict) -> list[dict]:
+    index = DatabaseIndex(tree)
+    teacher_id = index.teacher_id(teaching_token=index.teaching_tokens[0])
+    student_id = index.student_ids(teaching_token=index.teaching_tokens[0])[0]
+    print(f"Paths to delete: {len(plan_user_deletion(index, teacher_id))} (teacher), ", end="")
+    print(f"{len(plan_user_deletion(index, student_id))} (student)")
+
+    # A user without any class (e.g. a teacher who never created one) only owns its own nodes
+    unlinked_id = "unlinked-user"
+    unlinked_index = DatabaseIndex({**tree, "users": {**tree["users"], unlinked_id: {"id": unlinked_id}}})
+    plan = plan_user_deletion(unlinked_index, unlinked_id)
+    if set(plan) != {f"questions/{unlinked_id}", f"users/{unlinked_id}"}:
+        raise AssertionError(f"The plan of a user without any class lists {len(plan)} paths: {sorted(plan)[:5]}...")
+
+    # A student is only removed from their own class
+    student_plan = plan_user_deletion(index, student_id)
+    other_tokens = [token for token in index.teaching_tokens[1:] if student_id not in index.student_ids(token)]
+    if any(token in path for path in student_plan for token in other_tokens):
+        raise AssertionError("The plan of a student lists paths of the classes they never joined")
+
+    return [
+        measure("delete_user: plan a teacher", lambda: plan_user_deletion(index, teacher_id)),
+        measure("delete_user: plan a student", lambda: plan_user_deletion(index, student_id)),
+    ]
+
+
+def main():
+    run(database_from_env())
+
+
+if __name__ == "__main__":
+    main()
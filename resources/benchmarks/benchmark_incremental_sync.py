@@ -0,0 +1,77 @@
+import copy
+from pathlib import Path
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller import FirebaseController
+import firebase_controller.firebase_controller as firebase_controller_module
+from harness import measure
+from stubbed_firebase import StubbedDatabase
+from synthetic_database import database_from_env
+
+
+def run(tree: dict, folder: Path) -> list[dict]:
+    """
+    Syncs the stubbed database incrementally into [folder], then checks that the syncs which follow only download the
+    subtrees that changed, however many unchanged syncs happened in between
+    """
+    # The tree is modified by the check
+    tree = copy.deepcopy(tree)
+    database = StubbedDatabase(tree={"v0_1_0": tree}, latency=0)
+    # The answers and the tokens are fetched one class at a time, the other sections (e.g. the users) whole
+    subtree_count = sum(len(tree[node]) if node in ("answers", "tokens") else 1 for node in tree)
+
+    def sync() -> int:
+        """Returns the number of subtrees downloaded"""
+        database.counts["not_modified"] = 0
+        controller = FirebaseController.from_snapshot(temporary_folder=folder)
+        controller._incremental_refresh = True
+        controller.load_database(force_download=True)
+        return subtree_count - database.counts["not_modified"]
+
+    previous_db = firebase_controller_module.db
+    firebase_controller_module.db = database
+    try:
+        reads = database.counts["reads"]
+        sync()
+        # The shallow listings of the database and of the two split sections, then one request per subtree
+        request_count = database.counts["reads"] - reads
+        if request_count != 3 + subtree_count:
+            raise AssertionError(f"A sync made {request_count} requests instead of {3 + subtree_count}")
+        for attempt in range(2):
+            fetched_count = sync()
+            if fetched_count != 0:
+                raise AssertionError(f"Unchanged sync {attempt + 1} downloaded {fetched_count} subtrees instead of 0")
+
+        # Only the class that received a message is downloaded again
+        token, students = next(iter(tree["answers"].items()))
+        answers = next(iter(students.values()))
+        next(iter(answers.values()))["discussion"]["new-message"] = {"creationTimeStamp": 0, "text": "Nouveau"}
+        fetched_count = sync()
+        if fetched_count != 1:
+            raise AssertionError(f"A sync after a change downloaded {fetched_count} subtrees instead of 1")
+
+        # A change of a user downloads the users again, as a single section
+        next(iter(tree["users"].values()))["avatar"] = "🐱"
+        fetched_count = sync()
+        if fetched_count != 1:
+            raise AssertionError(f"A sync after a change of a user downloaded {fetched_count} subtrees instead of 1")
+        controller = FirebaseController.from_snapshot(temporary_folder=folder)
+        controller.load_database()
+        if controller.database["users"] != tree["users"]:
+            raise AssertionError("The synced users differ from the database")
+
+        return [measure("incremental sync: nothing changed", sync)]
+    finally:
+        firebase_controller_module.db = previous_db
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        run(database_from_env(), Path(folder))
+
+
+if __name__ == "__main__":
+    main()
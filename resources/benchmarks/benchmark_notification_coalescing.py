@@ -0,0 +1,155 @@
+import types
+
+from harness import measure
+from stubbed_firebase import StubbedDatabase, StubbedMessaging, load_functions_module
+from synthetic_database import generate_database
+
+_window = 60
+
+
+class _FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+def run() -> list[dict]:
+    """
+    Checks the notifications sent when coalescing is enabled: the messages buffered by notify_on_new_message are only
+    sent [_window] seconds after the oldest of them, merged in a single notification per receiver. The database and FCM
+    are stubbed and the time of the functions is a fake clock, so the scenarios run instantly.
+    """
+    tree = {"v0_1_0": generate_database(classes=1, students_per_class=3, questions_per_teacher=1)}
+    for user in tree["v0_1_0"]["users"].values():
+        user["pushNotificationsTokens"] = {f"fcm-{user['id']}": True}
+
+    database = StubbedDatabase(tree=tree, latency=0)
+    messaging = StubbedMessaging(latency=0)
+    functions = load_functions_module(
+        database=database, messaging=messaging, parameters={"NOTIFICATION_COALESCING_WINDOW_SECONDS": _window}
+    )
+    clock = _FakeClock(now=1_700_000_000.0)
+    functions.time = clock
+
+    token, students = next(iter(tree["v0_1_0"]["answers"].items()))
+    teacher_id = tree["v0_1_0"]["tokens"][token]["metadata"]["createdBy"]
+    student_ids = list(students)
+    users = tree["v0_1_0"]["users"]
+    for student_id in student_ids:
+        functions.update_routing_on_connection(
+            types.SimpleNamespace(
+                params={"token": token, "studentId": student_id}, data=types.SimpleNamespace(before=None, after=True)
+            )
+        )
+
+    message_count = 0
+
+    def send(student_id: str, creator_id: str) -> None:
+        nonlocal message_count
+        message_count += 1
+        question_id = next(iter(students[student_id]))
+        functions.notify_on_new_message(
+            types.SimpleNamespace(
+                params={
+                    "token": token,
+                    "studentId": student_id,
+                    "questionId": question_id,
+                    "responseId": f"message-{message_count}",
+                },
+                data={"creatorId": creator_id},
+            )
+        )
+
+    def flush_after(seconds: float, start: float) -> list[tuple[list[str], str]]:
+        clock.now = start + seconds
+        sent_count = len(messaging.sent)
+        functions.flush_pending_notifications(None)
+        return [(message.tokens, message.notification.body) for message in messaging.sent[sent_count:]]
+
+    def student_name(student_id: str) -> str:
+        user = users[student_id]
+        return f"{user['firstName']} {user['lastName']} ({user['avatar']})"
+
+    # The teacher sends 3 messages to a student within a few seconds
+    start = clock.now
+    for seconds in range(3):
+        clock.now = start + seconds
+        send(student_ids[0], creator_id=teacher_id)
+    _check(flush_after(10, start), [], "teacher to student, flushed at +10 s")
+    _check(
+        flush_after(_window, start),
+        [([f"fcm-{student_ids[0]}"], "Ton enseignant.e a envoyé 3 messages!")],
+        "teacher to student, flushed at +60 s",
+    )
+    _check(flush_after(2 * _window, start), [], "teacher to student, flushed again")
+
+    # A student sends 3 messages to the teacher
+    start = clock.now
+    for seconds in range(3):
+        clock.now = start + seconds
+        send(student_ids[1], creator_id=student_ids[1])
+    _check(flush_after(10, start), [], "student to teacher, flushed at +10 s")
+    _check(
+        flush_after(_window, start),
+        [([f"fcm-{teacher_id}"], f"{student_name(student_ids[1])} vous a envoyé 3 messages.")],
+        "student to teacher, flushed at +60 s",
+    )
+
+    # Two students write to the teacher, the messages received after the first flush are kept for the next one
+    start = clock.now
+    send(student_ids[0], creator_id=student_ids[0])
+    clock.now = start + 1
+    send(student_ids[1], creator_id=student_ids[1])
+    clock.now = start + 10
+    send(student_ids[2], creator_id=student_ids[2])
+    _check(
+        flush_after(_window, start),
+        [([f"fcm-{teacher_id}"], "3 nouveaux messages de 3 élèves.")],
+        "several students to teacher, flushed at +60 s",
+    )
+    clock.now = start + _window + 1
+    send(student_ids[0], creator_id=student_ids[0])
+    _check(flush_after(_window + 30, start), [], "message after the flush, flushed at +90 s")
+    _check(
+        flush_after(2 * _window + 1, start),
+        [([f"fcm-{teacher_id}"], f"{student_name(student_ids[0])} vous a envoyé un message.")],
+        "message after the flush, flushed at +121 s",
+    )
+
+    # Without coalescing the scheduled flush does not even read the database
+    idle_functions = load_functions_module(
+        database=database, messaging=messaging, parameters={"NOTIFICATION_COALESCING_WINDOW_SECONDS": 0}
+    )
+    reads = database.counts["reads"]
+    idle_functions.flush_pending_notifications(None)
+    if database.counts["reads"] != reads:
+        raise AssertionError("The flush read the database while coalescing is disabled")
+    print("Every coalescing scenario sent the expected notifications")
+
+    # One pending message for each of the receivers of a large school
+    receiver_count = 1000
+    pending = {
+        f"receiver-{index}": {"message-1": {"senderName": "", "createdAt": clock.now - _window}}
+        for index in range(receiver_count)
+    }
+    return [
+        measure(
+            f"notification coalescing: {receiver_count} receivers",
+            lambda: functions._coalesce_notifications(pending=pending, now=clock.now, window=_window),
+        )
+    ]
+
+
+def _check(notifications: list[tuple[list[str], str]], expected: list[tuple[list[str], str]], scenario: str) -> None:
+    if notifications != expected:
+        raise AssertionError(f"{scenario}: sent {notifications} instead of {expected}")
+
+
+def main():
+    run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import statistics
+import time
+import types
+
+from stubbed_firebase import StubbedDatabase, StubbedMessaging, load_functions_module
+from synthetic_database import generate_database
+
+
+def run(latency: float = 0.02) -> list[dict]:
+    # Simulates a class where each student sends a burst of messages to their teacher, who answers each of them
+    tree = {"v0_1_0": generate_database(classes=1, students_per_class=10, questions_per_teacher=1)}
+    for user in tree["v0_1_0"]["users"].values():
+        user["pushNotificationsTokens"] = {f"fcm-{user['id']}": True}
+
+    database = StubbedDatabase(tree=tree, latency=latency)
+    messaging = StubbedMessaging(latency=latency)
+    functions = load_functions_module(database=database, messaging=messaging)
+
+    token, students = next(iter(tree["v0_1_0"]["answers"].items()))
+
+    # The routing nodes are created by the triggers when the students join the class
+    for student_id in students:
+        functions.update_routing_on_connection(
+            types.SimpleNamespace(
+                params={"token": token, "studentId": student_id}, data=types.SimpleNamespace(before=None, after=True)
+            )
+        )
+    database.counts.update(reads=0, writes=0)
+
+    durations = []
+    for student_id, answers in students.items():
+        question_id, answer = next(iter(answers.items()))
+        for message_index in range(5):
+            creator_id = student_id if message_index < 4 else answer["createdById"]
+            event = types.SimpleNamespace(
+                params={
+                    "token": token,
+                    "studentId": student_id,
+                    "questionId": question_id,
+                    "responseId": f"{student_id}-{message_index}",
+                },
+                data={"creatorId": creator_id},
+            )
+            tic = time.perf_counter()
+            functions.notify_on_new_message(event)
+            durations.append(time.perf_counter() - tic)
+
+    print(f"Messages: {len(durations)} (simulated round-trip: {latency * 1000:.0f} ms)")
+    print(f"Database reads per message: {database.counts['reads'] / len(durations):.2f}")
+    print(f"Latency per message: mean {statistics.mean(durations) * 1000:.1f} ms, max {max(durations) * 1000:.1f} ms")
+    print(f"Notifications sent: {len(messaging.sent)}")
+
+    # The app stores the tokens of a user as a list, an unregistered token must be removed from it
+    student_id = next(iter(students))
+    fcm_tokens = [f"fcm-{student_id}", "fcm-uninstalled"]
+    tree["v0_1_0"]["users"][student_id]["pushNotificationsTokens"] = list(fcm_tokens)
+    messaging.unregistered_tokens.add("fcm-uninstalled")
+    functions._send_notification(receiver_id=student_id, title="Nouveau message", body="Test", fcm_tokens=fcm_tokens)
+    fcm_tokens = tree["v0_1_0"]["users"][student_id]["pushNotificationsTokens"]
+    if fcm_tokens != [f"fcm-{student_id}"]:
+        raise AssertionError(f"The unregistered token was not removed from the list: {fcm_tokens}")
+    return [
+        {
+            "name": "notify_on_new_message: per message",
+            "repeat": len(durations),
+            "min": min(durations),
+            "median": statistics.median(durations),
+            "mean": statistics.mean(durations),
+        }
+    ]
+
+
+def main():
+    run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import csv
+import io
+from pathlib import Path
+import sys
+import tempfile
+import zipfile
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from database_to_excel import _columns, _title_content_text, iterate_sorted_rows
+from firebase_controller import FirebaseController, PhotoBundleWriter
+from harness import measure
+from synthetic_database import generate_database, photo_paths, write_snapshot
+
+
+def run(folder: Path) -> list[dict]:
+    """
+    Bundles the discussions of a synthetic class with the thumbnails of its photos, which are written to the storage
+    mirror beforehand. Checks that every photo gets its thumbnail and that only the photo messages refer to one.
+    """
+    from PIL import Image
+
+    tree = generate_database(
+        classes=1, students_per_class=10, questions_per_teacher=5, messages_per_question=2, photos_per_question=1
+    )
+    photo = io.BytesIO()
+    Image.new("RGB", (1600, 1200), "white").save(photo, format="JPEG")
+    for path in photo_paths(tree):
+        filepath = folder / "storage" / path
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_bytes(photo.getvalue())
+
+    write_snapshot(tree, folder)
+    controller = FirebaseController.from_snapshot(temporary_folder=folder)
+    controller.load_database()
+
+    def bundle() -> None:
+        writer = PhotoBundleWriter(
+            folder / "output.zip",
+            columns=_columns,
+            storage_folder=folder / "storage",
+            photo_column=_columns.index(_title_content_text),
+            sheet_format="csv",
+        )
+        with writer:
+            for row in iterate_sorted_rows(controller, photo_flags=True):
+                writer.write_row(row)
+
+    results = [measure(f"photo bundle: {len(photo_paths(tree))} photos", bundle)]
+
+    with zipfile.ZipFile(folder / "output.zip") as archive:
+        thumbnails = [name for name in archive.namelist() if name.startswith("photos/")]
+        sheet = list(csv.DictReader(io.TextIOWrapper(archive.open("discussions.csv"), encoding="utf-8")))
+    if len(thumbnails) != len(photo_paths(tree)):
+        raise AssertionError(f"{len(thumbnails)} thumbnails were bundled instead of {len(photo_paths(tree))}")
+    referenced = {row["Photo"] for row in sheet if row["Photo"]}
+    if referenced != set(thumbnails):
+        raise AssertionError("The Photo column does not refer to exactly the bundled thumbnails")
+    return results
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        run(Path(folder))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+from pathlib import Path
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller import DatabaseIndex
+from firebase_controller.snapshot import Snapshot
+from harness import measure
+from synthetic_database import database_from_env
+
+
+def _build_index(tree) -> None:
+    index = DatabaseIndex(tree)
+    for token in index.teaching_tokens:
+        index.questions(teacher_id=index.teacher_id(teaching_token=token))
+        for student_id in index.student_ids(teaching_token=token):
+            index.user(user_id=student_id)
+            index.answers(teaching_token=token, student_id=student_id)
+
+
+def run(tree: dict, folder: Path) -> list[dict]:
+    filepath = folder / "firebase_export.sqlite"
+    Snapshot.write(filepath, tree)
+    return [
+        measure("snapshot: write", lambda: Snapshot.write(filepath, tree)),
+        measure("snapshot: load every section", lambda: [Snapshot(filepath)[name] for name in tree]),
+        measure("snapshot: load the users only", lambda: Snapshot(filepath)["users"]),
+        measure("index: build every table", lambda: _build_index(tree)),
+    ]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        run(database_from_env(), Path(folder))
+
+
+if __name__ == "__main__":
+    main()
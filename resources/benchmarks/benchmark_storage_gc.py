@@ -0,0 +1,127 @@
+import bisect
+from datetime import datetime, timedelta, timezone
+import math
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller import FirebaseController
+import firebase_controller.firebase_controller as firebase_controller_module
+from firebase_controller.token_archives import encode_token_archive, plan_token_archives, token_archive_name
+from harness import measure
+from stubbed_firebase import StubbedBucket
+from synthetic_database import generate_database, photo_paths, write_snapshot
+
+_grace_period = timedelta(days=7)
+_max_deletes_per_second = 100.0
+# The collector lists the bucket by pages of 1000 files
+_page_size = 1000
+
+
+class _StubbedStorage:
+    def __init__(self, bucket: StubbedBucket):
+        self._bucket = bucket
+
+    def bucket(self) -> StubbedBucket:
+        return self._bucket
+
+
+def run(folder: Path) -> list[dict]:
+    """
+    Collects the garbage of a stubbed bucket of several pages, holding the photos of the discussions, the photos of an
+    archived class, orphans older and younger than the grace period and files which are not photos. Checks that only
+    the old orphans are deleted, that a dry run deletes nothing and that the deletions respect their rate limit.
+    """
+    tree = generate_database(
+        classes=3, students_per_class=20, questions_per_teacher=20, messages_per_question=0, photos_per_question=1
+    )
+    now = datetime.now(timezone.utc)
+    old = now - 2 * _grace_period
+    bucket = StubbedBucket(latency=0.001)
+    for path in photo_paths(tree):
+        bucket.add(path, b"photo", time_created=old)
+
+    # The photos of an archived class are referenced by its archive, not by the database
+    archived_token = next(iter(tree["answers"]))
+    archived_photos = photo_paths({"answers": {archived_token: tree["answers"][archived_token]}})
+    archive = plan_token_archives(tree, [archived_token])[archived_token]
+    bucket.add(
+        token_archive_name(archived_token),
+        encode_token_archive(archived_token, archive, archived_at=0),
+        time_created=old,
+    )
+    del tree["answers"][archived_token]
+    del tree["tokens"][archived_token]
+
+    user_ids = list(tree["users"])
+    old_orphans = {f"{user_ids[index % len(user_ids)]}/old-orphan-{index}.jpg" for index in range(150)}
+    recent_orphans = {f"{user_ids[index % len(user_ids)]}/recent-orphan-{index}.jpg" for index in range(50)}
+    not_photos = {"exports/2024/output.xlsx", "notes.txt"}
+    for name in old_orphans | not_photos:
+        bucket.add(name, b"garbage", time_created=old)
+    for name in recent_orphans:
+        bucket.add(name, b"garbage", time_created=now - _grace_period / 2)
+    if math.ceil(len(bucket.blobs) / _page_size) < 2:
+        raise AssertionError("The bucket must be listed in several pages")
+    kept = set(bucket.blobs) - old_orphans
+
+    write_snapshot(tree, folder)
+    controller = FirebaseController.from_snapshot(temporary_folder=folder)
+
+    def collect(dry_run: bool) -> dict:
+        return controller.collect_storage_garbage(
+            grace_period=_grace_period, dry_run=dry_run, max_deletes_per_second=_max_deletes_per_second
+        )
+
+    previous_storage = firebase_controller_module.storage
+    firebase_controller_module.storage = _StubbedStorage(bucket)
+    try:
+        report = collect(dry_run=True)
+        if set(report["orphans"]) != old_orphans:
+            raise AssertionError(f"The dry run found {len(report['orphans'])} orphans instead of {len(old_orphans)}")
+        if report["deleted"] or bucket.deleted_at or set(bucket.blobs) != kept | old_orphans:
+            raise AssertionError("The dry run deleted files")
+        if report["recent"] != len(recent_orphans):
+            raise AssertionError(f"{report['recent']} recent files were found instead of {len(recent_orphans)}")
+        if not set(archived_photos) <= kept:
+            raise AssertionError("The photos of the archived class are not referenced")
+        results = [measure(f"storage gc: dry run over {len(bucket.blobs)} files", lambda: collect(dry_run=True))]
+
+        tic = time.monotonic()
+        report = collect(dry_run=False)
+        elapsed = time.monotonic() - tic
+        if report["deleted"] != len(old_orphans) or set(bucket.blobs) != kept:
+            raise AssertionError(f"{report['deleted']} files were deleted instead of the {len(old_orphans)} orphans")
+
+        # No window of one second may hold more deletions than the limit, give or take the timing jitter, and all of
+        # them cannot take less time than the limit allows
+        deleted_at = sorted(bucket.deleted_at)
+        busiest_second = max(
+            bisect.bisect_left(deleted_at, start + 1.0) - index for index, start in enumerate(deleted_at)
+        )
+        minimum_duration = (len(deleted_at) - 1) / _max_deletes_per_second
+        if deleted_at[-1] - deleted_at[0] < minimum_duration * 0.95:
+            raise AssertionError(f"The deletions took less than the {minimum_duration:.2f} s the limit allows")
+        if busiest_second > _max_deletes_per_second * 1.05 + 1:
+            raise AssertionError(
+                f"{busiest_second} files were deleted within a second, the limit is {_max_deletes_per_second:g}"
+            )
+        print(
+            f"{report['deleted']} orphans deleted in {elapsed:.2f} s, at most {busiest_second} within a second "
+            f"(limit {_max_deletes_per_second:g})"
+        )
+        return results
+    finally:
+        firebase_controller_module.storage = previous_storage
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        run(Path(folder))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import copy
+from pathlib import Path
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller import FirebaseController
+import firebase_controller.firebase_controller as firebase_controller_module
+from firebase_controller.token_archives import archivable_tokens, plan_token_archives, token_archive_name
+from harness import measure
+from stubbed_firebase import StubbedBlob, StubbedBucket, StubbedDatabase
+from synthetic_database import generate_database, write_snapshot
+
+# Every synthetic class is idle long before that
+_cutoff = 1 << 62
+
+
+class _StubbedStorage:
+    def __init__(self, bucket: StubbedBucket):
+        self._bucket = bucket
+
+    def bucket(self) -> StubbedBucket:
+        return self._bucket
+
+
+def run(folder: Path) -> list[dict]:
+    """
+    Archives the classes of a stubbed database while some of them change, then restores them after one of their
+    students was deleted. Checks that a class which changed since the download, or while it was archived, is left in
+    the database, and that the restore does not recreate the deleted student.
+    """
+    tree = generate_database(classes=4, students_per_class=5, questions_per_teacher=2, messages_per_question=2)
+    write_snapshot(tree, folder)
+    live = copy.deepcopy(tree)
+    database = StubbedDatabase(tree={"v0_1_0": live}, latency=0)
+    bucket = StubbedBucket(latency=0)
+    changed_before, changed_during, *archivable = list(tree["answers"])
+
+    # A student joins a class after the download, and another one while the archive of a second class is uploaded
+    live["tokens"][changed_before]["connectedUsers"]["late-student"] = True
+    upload = StubbedBlob.upload_from_string
+
+    def upload_and_join(blob: StubbedBlob, data: bytes, **kwargs) -> None:
+        upload(blob, data, **kwargs)
+        if blob.name == token_archive_name(changed_during):
+            live["tokens"][changed_during]["connectedUsers"]["late-student"] = True
+
+    previous_db, previous_storage = firebase_controller_module.db, firebase_controller_module.storage
+    firebase_controller_module.db = database
+    firebase_controller_module.storage = _StubbedStorage(bucket)
+    StubbedBlob.upload_from_string = upload_and_join
+    try:
+        controller = FirebaseController.from_snapshot(temporary_folder=folder)
+        archived = controller.archive_tokens(cutoff=_cutoff)
+        if sorted(archived) != sorted(archivable):
+            raise AssertionError(f"The classes {sorted(archived)} were archived instead of {sorted(archivable)}")
+        for token in (changed_before, changed_during):
+            if token not in live["tokens"] or token_archive_name(token) in bucket.blobs:
+                raise AssertionError(f"The class {token} changed but it was archived")
+        for token in archivable:
+            if token in live["answers"] or token in live["tokens"]:
+                raise AssertionError(f"The archived class {token} is still in the database")
+
+        # A student of an archived class deletes their account, the restore must not bring a part of it back
+        token = archivable[0]
+        deleted_id = next(iter(tree["tokens"][token]["connectedUsers"]))
+        del live["users"][deleted_id]
+        restored = controller.restore_tokens(tokens=archivable)
+        if sorted(restored) != sorted(archivable):
+            raise AssertionError(f"The classes {sorted(restored)} were restored instead of {sorted(archivable)}")
+        if deleted_id in live["users"]:
+            raise AssertionError(f"The restore recreated the deleted user {deleted_id}: {live['users'][deleted_id]}")
+        for token in archivable:
+            if live["answers"][token] != tree["answers"][token] or live["tokens"][token] != tree["tokens"][token]:
+                raise AssertionError(f"The class {token} was not restored as it was archived")
+    finally:
+        StubbedBlob.upload_from_string = upload
+        firebase_controller_module.db = previous_db
+        firebase_controller_module.storage = previous_storage
+
+    return [
+        measure(
+            "token archives: plan every class",
+            lambda: plan_token_archives(tree, archivable_tokens(tree, cutoff=_cutoff)),
+        )
+    ]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        run(Path(folder))
+
+
+if __name__ == "__main__":
+    main()
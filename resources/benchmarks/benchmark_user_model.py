@@ -0,0 +1,40 @@
+from pathlib import Path
+import sys
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller import UserModel
+from harness import measure
+from synthetic_database import database_from_env
+
+
+def run(tree: dict) -> list[dict]:
+    users = list(tree["users"].values())
+    models = UserModel.from_serialized_many(users)
+
+    # The serialization must round-trip
+    if UserModel.serialize_many(UserModel.from_serialized_many(UserModel.serialize_many(models))) != (
+        UserModel.serialize_many(models)
+    ):
+        raise AssertionError("UserModel does not round-trip through serialize_many/from_serialized_many")
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    kept = UserModel.from_serialized_many(users)
+    allocated = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot_before, "filename"))
+    tracemalloc.stop()
+    print(f"Users: {len(kept)}, {allocated / len(kept):.0f} bytes allocated per model")
+
+    return [
+        measure("user_model: from_serialized_many", lambda: UserModel.from_serialized_many(users)),
+        measure("user_model: serialize_many", lambda: UserModel.serialize_many(models)),
+    ]
+
+
+def main():
+    run(database_from_env())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# Only for the load tests on the emulators (load_test_notifications.py): Python imports this module at startup when its
+# folder is on the PYTHONPATH, e.g. PYTHONPATH=resources/benchmarks/emulator_stubs firebase emulators:start
+# The functions then send their notifications to a fake FCM, which records them under stubbedNotifications along with
+# the number of database reads made so far by the instance. The functions themselves are left untouched.
+import threading
+import time
+import types
+import uuid
+
+try:
+    from firebase_admin import db, messaging
+except ImportError:
+    # Any other Python process started with this PYTHONPATH (e.g. the discovery of the functions by the CLI)
+    db = messaging = None
+
+_instance_id = uuid.uuid4().hex
+_database_reads = 0
+_database_reads_lock = threading.Lock()
+
+
+def _counted_get(get):
+    def counted_get(self, *args, **kwargs):
+        global _database_reads
+        with _database_reads_lock:
+            _database_reads += 1
+        return get(self, *args, **kwargs)
+
+    return counted_get
+
+
+def _send_each_for_multicast(message, dry_run: bool = False):
+    # Pushed rather than set, so a message notified twice shows up as a duplicate
+    db.reference("/v0_1_0/stubbedNotifications").push(
+        {
+            "tokens": message.tokens,
+            "body": message.notification.body,
+            "sentAt": int(time.time() * 1_000_000),
+            "instanceId": _instance_id,
+            "instanceReads": _database_reads,
+        }
+    )
+    responses = [types.SimpleNamespace(success=True, exception=None) for _ in message.tokens]
+    return types.SimpleNamespace(responses=responses, success_count=len(responses), failure_count=0)
+
+
+if db is not None:
+    db.Reference.get = _counted_get(db.Reference.get)
+    messaging.send_each_for_multicast = _send_each_for_multicast
@@ -0,0 +1,50 @@
+import json
+import os
+from pathlib import Path
+import statistics
+import time
+from typing import Any, Callable
+
+
+def measure(name: str, function: Callable[[], Any], repeat: int | None = None, setup: Callable[[], Any] = None) -> dict:
+    """
+    Times [function] [repeat] times (BENCHMARK_REPEAT, 5 by default), calling [setup] untimed before each run. The
+    minimum is the most stable number to compare between two runs, the median shows how noisy the machine is.
+    """
+    repeat = int(os.getenv("BENCHMARK_REPEAT", "5")) if repeat is None else repeat
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        tic = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - tic)
+
+    result = {
+        "name": name,
+        "repeat": repeat,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+    }
+    print(f"{name:<50} min {result['min'] * 1000:>10.1f} ms    median {result['median'] * 1000:>10.1f} ms")
+    return result
+
+
+def save_results(results: list[dict], filepath: Path) -> None:
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def compare_results(results: list[dict], baseline_filepath: Path) -> None:
+    """Prints the speedup of each benchmark of [results] relative to the same benchmark in a previous results file"""
+    with open(baseline_filepath, "r", encoding="utf-8") as f:
+        baseline = {result["name"]: result for result in json.load(f)}
+
+    print(f"Compared to {baseline_filepath}:")
+    for result in results:
+        if result["name"] not in baseline:
+            continue
+        ratio = baseline[result["name"]]["min"] / max(result["min"], 1e-12)
+        print(f"    {result['name']:<46} {ratio:>6.2f}x {'faster' if ratio >= 1 else 'slower'}")
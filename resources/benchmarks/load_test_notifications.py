@@ -0,0 +1,237 @@
+import asyncio
+from datetime import datetime
+import os
+from pathlib import Path
+import random
+import statistics
+import time
+import uuid
+
+import httpx
+
+from harness import save_results
+from synthetic_database import generate_database
+
+
+class _EmulatorDatabase:
+    """REST access to the database emulator, the "owner" token bypasses the security rules"""
+
+    def __init__(self, client: httpx.AsyncClient, namespace: str):
+        self._client = client
+        self._namespace = namespace
+
+    async def get(self, path: str, shallow: bool = False):
+        params = {"ns": self._namespace}
+        if shallow:
+            params["shallow"] = "true"
+        response = await self._client.get(_url(path), params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def put(self, path: str, value) -> None:
+        response = await self._client.put(_url(path), params={"ns": self._namespace}, json=value)
+        response.raise_for_status()
+
+
+def _url(path: str) -> str:
+    return f"/v0_1_0/{path}.json" if path else "/v0_1_0.json"
+
+
+async def _seed(database: _EmulatorDatabase, classes: int, students_per_class: int, timeout: float) -> dict:
+    """
+    Replaces the database by [classes] classes without any message and waits for the triggers to build the
+    notification routing node of every student
+    """
+    tree = generate_database(
+        classes=classes, students_per_class=students_per_class, questions_per_teacher=1, messages_per_question=0
+    )
+    for user in tree["users"].values():
+        user["pushNotificationsTokens"] = {f"fcm-{user['id']}": True}
+    await database.put("", tree)
+
+    expected_count = classes * students_per_class
+    deadline = time.monotonic() + timeout
+    while True:
+        routing = await database.get("notificationRouting") or {}
+        routed_count = sum(len(students) for students in routing.values())
+        if routed_count >= expected_count:
+            return tree
+        if time.monotonic() > deadline:
+            raise TimeoutError(
+                f"Only {routed_count} out of {expected_count} routing nodes were built, are the functions emulated?"
+            )
+        await asyncio.sleep(1)
+
+
+async def _fire_messages(
+    database: _EmulatorDatabase, tree: dict, rate: float, duration: float, seed: int = 42
+) -> tuple[list[tuple[str, int]], int]:
+    """
+    Writes new messages at a fixed [rate] per second for [duration] seconds, whatever the time each write takes. Half of
+    them are sent by a student, the other half by their teacher. Returns the receiver and the creation time of each
+    message written, and the number of failed writes.
+    """
+    rng = random.Random(seed)
+    answers = [
+        (token, student_id, question_id, answer["createdById"])
+        for token, students in tree["answers"].items()
+        for student_id, student_answers in students.items()
+        for question_id, answer in student_answers.items()
+    ]
+
+    sent: list[tuple[str, int]] = []
+    failures = 0
+
+    async def write(token: str, student_id: str, question_id: str, creator_id: str, receiver_id: str) -> None:
+        nonlocal failures
+        message_id = uuid.uuid4().hex
+        creation_timestamp = int(time.time() * 1_000_000)
+        message = {
+            "creationTimeStamp": creation_timestamp,
+            "creatorId": creator_id,
+            "id": message_id,
+            "isPhotoUrl": False,
+            "studentId": student_id,
+            "text": f"Message {message_id}",
+        }
+        try:
+            await database.put(f"answers/{token}/{student_id}/{question_id}/discussion/{message_id}", message)
+        except httpx.HTTPError:
+            failures += 1
+            return
+        sent.append((receiver_id, creation_timestamp))
+
+    tasks = []
+    start = time.monotonic()
+    for index in range(int(rate * duration)):
+        await asyncio.sleep(max(0.0, start + index / rate - time.monotonic()))
+        token, student_id, question_id, teacher_id = rng.choice(answers)
+        creator_id, receiver_id = (student_id, teacher_id) if rng.random() < 0.5 else (teacher_id, student_id)
+        tasks.append(asyncio.create_task(write(token, student_id, question_id, creator_id, receiver_id)))
+    await asyncio.gather(*tasks)
+    return sent, failures
+
+
+async def _wait_for_notifications(database: _EmulatorDatabase, expected_count: int, settle_time: float) -> dict:
+    """Polls the stubbed notifications until one was recorded per message or none arrived for [settle_time] seconds"""
+    notifications = {}
+    last_progress = time.monotonic()
+    while len(notifications) < expected_count and time.monotonic() - last_progress < settle_time:
+        await asyncio.sleep(1)
+        current = await database.get("stubbedNotifications") or {}
+        if len(current) > len(notifications):
+            last_progress = time.monotonic()
+        notifications = current
+    return notifications
+
+
+def _report(sent: list[tuple[str, int]], write_failures: int, notifications: dict, elapsed: float) -> dict:
+    # The fake FCM only knows the tokens of the receiver (fcm-{userId}), so the notifications of a receiver are paired
+    # with its messages in order. The latencies are approximate when the messages of a receiver are notified out of order
+    messages_by_receiver: dict[str, list[int]] = {}
+    for receiver_id, creation_timestamp in sent:
+        messages_by_receiver.setdefault(receiver_id, []).append(creation_timestamp)
+    notifications_by_receiver: dict[str, list[int]] = {}
+    reads_by_instance: dict[str, list[int]] = {}
+    for record in notifications.values():
+        for fcm_token in record["tokens"]:
+            notifications_by_receiver.setdefault(fcm_token.removeprefix("fcm-"), []).append(record["sentAt"])
+        reads_by_instance.setdefault(record["instanceId"], []).append(record["instanceReads"])
+
+    latencies = []
+    dropped_count = 0
+    duplicated_count = 0
+    for receiver_id, creation_timestamps in messages_by_receiver.items():
+        sent_timestamps = sorted(notifications_by_receiver.get(receiver_id, []))
+        latencies += [
+            (sent_at - created_at) / 1_000_000
+            for created_at, sent_at in zip(sorted(creation_timestamps), sent_timestamps)
+        ]
+        dropped_count += max(0, len(creation_timestamps) - len(sent_timestamps))
+        duplicated_count += max(0, len(sent_timestamps) - len(creation_timestamps))
+
+    # The reads are counted per instance since it started, so each instance gives the reads made between its first and
+    # its last notification
+    reads = sum(max(counts) - min(counts) for counts in reads_by_instance.values())
+    notified_count = sum(len(counts) - 1 for counts in reads_by_instance.values())
+
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "name": "load test: notify_on_new_message",
+        "messages": len(sent),
+        "messages_per_second": len(sent) / elapsed,
+        "write_failures": write_failures,
+        "notified": len(latencies),
+        "dropped": dropped_count,
+        "duplicated": duplicated_count,
+        "instances": len(reads_by_instance),
+        "reads_per_message": reads / notified_count if notified_count else None,
+        "latency_p50": percentiles[49] if latencies else None,
+        "latency_p90": percentiles[89] if latencies else None,
+        "latency_p99": percentiles[98] if latencies else None,
+        "latency_max": max(latencies) if latencies else None,
+    }
+
+
+async def _run() -> dict:
+    host = os.getenv("FIREBASE_DATABASE_EMULATOR_HOST", "localhost:9000")
+    namespace = os.getenv("LOAD_TEST_DATABASE_NAMESPACE", "monstageenimages-default-rtdb")
+    classes = int(os.getenv("LOAD_TEST_CLASSES", "10"))
+    students_per_class = int(os.getenv("LOAD_TEST_STUDENTS_PER_CLASS", "25"))
+    rate = float(os.getenv("LOAD_TEST_MESSAGES_PER_SECOND", "20"))
+    duration = float(os.getenv("LOAD_TEST_DURATION_SECONDS", "60"))
+    seed_timeout = float(os.getenv("LOAD_TEST_SEED_TIMEOUT_SECONDS", "120"))
+    settle_time = float(os.getenv("LOAD_TEST_SETTLE_SECONDS", "30"))
+
+    async with httpx.AsyncClient(
+        base_url=f"http://{host}", headers={"Authorization": "Bearer owner"}, timeout=30
+    ) as client:
+        database = _EmulatorDatabase(client=client, namespace=namespace)
+
+        print(f"Seeding {classes} classes of {students_per_class} students on the emulator at {host}...")
+        tree = await _seed(database, classes=classes, students_per_class=students_per_class, timeout=seed_timeout)
+
+        print(f"Writing {rate:g} messages per second for {duration:g} seconds...")
+        tic = time.monotonic()
+        sent, write_failures = await _fire_messages(database, tree, rate=rate, duration=duration)
+        elapsed = time.monotonic() - tic
+
+        print("Waiting for the notifications...")
+        notifications = await _wait_for_notifications(database, expected_count=len(sent), settle_time=settle_time)
+
+    return _report(sent, write_failures, notifications, elapsed)
+
+
+def main():
+    """
+    Load test of notify_on_new_message on the emulators, which must be started with emulator_stubs on the PYTHONPATH
+    (e.g. PYTHONPATH=resources/benchmarks/emulator_stubs firebase emulators:start) so the notifications are recorded in
+    the database by a fake FCM instead of being sent, along with the database reads of each instance.
+    The database of the emulator is replaced by LOAD_TEST_CLASSES classes of LOAD_TEST_STUDENTS_PER_CLASS students, then
+    LOAD_TEST_MESSAGES_PER_SECOND messages are written for LOAD_TEST_DURATION_SECONDS seconds.
+    """
+    report = asyncio.run(_run())
+
+    print(f"Messages: {report['messages']} ({report['messages_per_second']:.1f} per second)")
+    print(f"Failed writes: {report['write_failures']}")
+    print(f"Notified: {report['notified']}, dropped: {report['dropped']}, duplicated: {report['duplicated']}")
+    print(f"Function instances: {report['instances']}")
+    if report["reads_per_message"] is not None:
+        print(f"Database reads per message: {report['reads_per_message']:.2f}")
+    if report["latency_max"] is not None:
+        print(
+            f"Trigger latency: p50 {report['latency_p50'] * 1000:.0f} ms, p90 {report['latency_p90'] * 1000:.0f} ms, "
+            f"p99 {report['latency_p99'] * 1000:.0f} ms, max {report['latency_max'] * 1000:.0f} ms"
+        )
+
+    output_filepath = Path(
+        os.getenv(
+            "BENCHMARK_OUTPUT", Path(__file__).parent / "results" / f"load_test_{datetime.now():%Y%m%d_%H%M%S}.json"
+        )
+    )
+    save_results([report], output_filepath)
+    print(f"The results were saved to {output_filepath}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from datetime import datetime
+import os
+from pathlib import Path
+import tempfile
+
+import benchmark_analytics
+import benchmark_cold_start
+import benchmark_database_to_excel
+import benchmark_delete_user
+import benchmark_incremental_sync
+import benchmark_notification_coalescing
+import benchmark_notify_on_new_message
+import benchmark_photo_bundle
+import benchmark_snapshot
+import benchmark_storage_gc
+import benchmark_token_archives
+import benchmark_user_model
+from harness import compare_results, save_results
+from synthetic_database import database_from_env
+
+
+def main():
+    """
+    Runs every benchmark on the database sized by the BENCHMARK_* environment variables and saves the results. Set
+    BENCHMARK_BASELINE to the results of a previous run to print the speedup of each benchmark.
+    """
+    tree = database_from_env()
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        results += benchmark_snapshot.run(tree, Path(folder))
+    with tempfile.TemporaryDirectory() as folder:
+        results += benchmark_database_to_excel.run(tree, Path(folder))
+    with tempfile.TemporaryDirectory() as folder:
+        results += benchmark_analytics.run(tree, Path(folder))
+    with tempfile.TemporaryDirectory() as folder:
+        results += benchmark_incremental_sync.run(tree, Path(folder))
+    with tempfile.TemporaryDirectory() as folder:
+        results += benchmark_photo_bundle.run(Path(folder))
+    with tempfile.TemporaryDirectory() as folder:
+        results += benchmark_storage_gc.run(Path(folder))
+    with tempfile.TemporaryDirectory() as folder:
+        results += benchmark_token_archives.run(Path(folder))
+    results += benchmark_delete_user.run(tree)
+    results += benchmark_user_model.run(tree)
+    results += benchmark_notify_on_new_message.run()
+    results += benchmark_notification_coalescing.run()
+    results += benchmark_cold_start.run()
+
+    output_filepath = Path(
+        os.getenv("BENCHMARK_OUTPUT", Path(__file__).parent / "results" / f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    )
+    save_results(results, output_filepath)
+    print(f"The results were saved to {output_filepath}")
+
+    baseline_filepath = os.getenv("BENCHMARK_BASELINE", "")
+    if baseline_filepath:
+        compare_results(results, Path(baseline_filepath))
+
+
+if __name__ == "__main__":
+    main()
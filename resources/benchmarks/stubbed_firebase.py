@@ -0,0 +1,250 @@
+from datetime import datetime, timezone
+import hashlib
+import importlib.util
+import json
+from pathlib import Path
+import sys
+import threading
+import time
+import types
+from typing import Iterator
+import unittest.mock
+
+_functions_main_filepath = Path(__file__).parents[2] / "functions" / "main.py"
+
+
+class StubbedReference:
+    def __init__(self, database: "StubbedDatabase", path: str):
+        self._database = database
+        self._path = [part for part in path.split("/") if part]
+
+    def child(self, path: str) -> "StubbedReference":
+        return StubbedReference(self._database, "/".join(self._path) + "/" + path)
+
+    def get(self, etag: bool = False, shallow: bool = False):
+        self._database.wait("reads")
+        node = self._node()
+        if shallow and isinstance(node, dict):
+            node = {key: True for key in node}
+        return (node, _etag(node)) if etag else node
+
+    def get_if_changed(self, etag: str) -> tuple[bool, object, str | None]:
+        """Like firebase_admin, an unchanged node (HTTP 304) comes back as (False, None, None)"""
+        self._database.wait("reads")
+        node = self._node()
+        if _etag(node) == etag:
+            self._database.count("not_modified")
+            return False, None, None
+        return True, node, _etag(node)
+
+    def set(self, value) -> None:
+        self._database.wait("writes")
+        self._database.write(self._path, value)
+
+    def update(self, values: dict) -> None:
+        self._database.wait("writes")
+        for path, value in values.items():
+            self._database.write(self._path + [part for part in path.split("/") if part], value)
+
+    def delete(self) -> None:
+        self._database.wait("writes")
+        self._database.write(self._path, None)
+
+    def _node(self):
+        node = self._database.tree
+        for part in self._path:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+
+def _etag(node) -> str:
+    return hashlib.md5(json.dumps(node, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class StubbedDatabase:
+    """In-memory replacement of firebase_admin.db which simulates the round-trip [latency] of every request"""
+
+    def __init__(self, tree: dict, latency: float):
+        self.tree = tree
+        self.latency = latency
+        self.counts = {"reads": 0, "writes": 0}
+        self._lock = threading.Lock()
+
+    def reference(self, path: str = "/") -> StubbedReference:
+        return StubbedReference(self, path)
+
+    def wait(self, kind: str) -> None:
+        self.count(kind)
+        time.sleep(self.latency)
+
+    def count(self, kind: str) -> None:
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def write(self, path: list[str], value) -> None:
+        node = self.tree
+        for part in path[:-1]:
+            if value is None and (not isinstance(node, dict) or part not in node):
+                return
+            if isinstance(node.get(part), list):
+                # The database stores a list as a map of its indices
+                node[part] = {str(index): item for index, item in enumerate(node[part]) if item is not None}
+            node = node.setdefault(part, {})
+        if value is None:
+            node.pop(path[-1], None)
+        else:
+            node[path[-1]] = value
+
+
+class StubbedMessaging:
+    """
+    In-memory replacement of firebase_admin.messaging which records the multicast messages instead of sending them. The
+    [unregistered_tokens] fail as the tokens of an uninstalled app would.
+    """
+
+    def __init__(self, latency: float, unregistered_tokens: set[str] | None = None):
+        self.latency = latency
+        self.unregistered_tokens = set() if unregistered_tokens is None else unregistered_tokens
+        self.sent: list = []
+        self._lock = threading.Lock()
+
+    class Notification:
+        def __init__(self, title: str, body: str):
+            self.title = title
+            self.body = body
+
+    class MulticastMessage:
+        def __init__(self, notification, tokens: list[str]):
+            self.notification = notification
+            self.tokens = tokens
+
+    class BatchResponse:
+        def __init__(self, successes: list[bool]):
+            self.responses = [
+                types.SimpleNamespace(
+                    success=success,
+                    exception=None if success else types.SimpleNamespace(code="registration-token-not-registered"),
+                )
+                for success in successes
+            ]
+            self.success_count = sum(successes)
+            self.failure_count = len(successes) - self.success_count
+
+    def send_each_for_multicast(self, message) -> "StubbedMessaging.BatchResponse":
+        time.sleep(self.latency)
+        with self._lock:
+            self.sent.append(message)
+        return StubbedMessaging.BatchResponse([token not in self.unregistered_tokens for token in message.tokens])
+
+
+class StubbedBlob:
+    def __init__(self, bucket: "StubbedBucket", name: str, data: bytes, time_created: datetime | None):
+        self._bucket = bucket
+        self.name = name
+        self.size = len(data)
+        self.time_created = time_created
+        self._data = data
+
+    def exists(self) -> bool:
+        time.sleep(self._bucket.latency)
+        return self.name in self._bucket.blobs
+
+    def upload_from_string(self, data: bytes, content_type: str = None, if_generation_match: int | None = None) -> None:
+        time.sleep(self._bucket.latency)
+        if if_generation_match == 0 and self.name in self._bucket.blobs:
+            raise RuntimeError(f"412 Precondition Failed: {self.name} already exists")
+        self.size = len(data)
+        self.time_created = datetime.now(timezone.utc)
+        self._data = data
+        self._bucket.blobs[self.name] = self
+
+    def download_as_bytes(self) -> bytes:
+        time.sleep(self._bucket.latency)
+        return self._data
+
+    def delete(self) -> None:
+        time.sleep(self._bucket.latency)
+        self._bucket.delete(self.name)
+
+
+class StubbedBucket:
+    """
+    In-memory replacement of a storage bucket, listed one page at a time like google.cloud.storage. The time of every
+    deletion is recorded in [deleted_at] (time.monotonic) to check the rate limits.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.blobs: dict[str, StubbedBlob] = {}
+        self.deleted_at: list[float] = []
+        self._lock = threading.Lock()
+
+    def blob(self, name: str) -> StubbedBlob:
+        return self.blobs.get(name) or StubbedBlob(self, name=name, data=b"", time_created=None)
+
+    def add(self, name: str, data: bytes, time_created: datetime) -> None:
+        self.blobs[name] = StubbedBlob(self, name=name, data=data, time_created=time_created)
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            del self.blobs[name]
+            self.deleted_at.append(time.monotonic())
+
+    def list_blobs(self, prefix: str = "", page_size: int = 1000) -> "_StubbedBlobListing":
+        return _StubbedBlobListing(
+            self, [blob for name, blob in sorted(self.blobs.items()) if name.startswith(prefix)], page_size
+        )
+
+
+class _StubbedBlobListing:
+    def __init__(self, bucket: StubbedBucket, blobs: list[StubbedBlob], page_size: int):
+        self._bucket = bucket
+        self._blobs = blobs
+        self._page_size = page_size
+
+    @property
+    def pages(self) -> Iterator[list[StubbedBlob]]:
+        for start in range(0, len(self._blobs), self._page_size):
+            time.sleep(self._bucket.latency)
+            yield self._blobs[start : start + self._page_size]
+
+    def __iter__(self) -> Iterator[StubbedBlob]:
+        for page in self.pages:
+            yield from page
+
+
+def load_functions_module(
+    database: StubbedDatabase, messaging: StubbedMessaging, parameters: dict | None = None
+) -> types.ModuleType:
+    """Imports functions/main.py with the Firebase SDKs replaced by the stubs, [parameters] sets the params values"""
+    parameters = {} if parameters is None else parameters
+    firebase_functions = types.ModuleType("firebase_functions")
+    firebase_functions.db_fn = types.SimpleNamespace(
+        on_value_created=lambda **kwargs: (lambda function: function),
+        on_value_written=lambda **kwargs: (lambda function: function),
+        Event=object,
+    )
+    firebase_functions.options = types.SimpleNamespace(set_global_options=lambda **kwargs: None)
+    firebase_functions.params = types.SimpleNamespace(
+        IntParam=lambda name, default=None, **kwargs: types.SimpleNamespace(value=parameters.get(name, default))
+    )
+    firebase_functions.scheduler_fn = types.SimpleNamespace(on_schedule=lambda **kwargs: (lambda function: function))
+
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin.initialize_app = lambda **kwargs: None
+    firebase_admin.db = database
+    firebase_admin.messaging = messaging
+
+    # The stubs only replace the SDKs during the import, so the other benchmarks of the process still get the real ones
+    with unittest.mock.patch.dict(
+        sys.modules, {"firebase_functions": firebase_functions, "firebase_admin": firebase_admin}
+    ):
+        spec = importlib.util.spec_from_file_location("functions_main", _functions_main_filepath)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        # The Admin SDK is imported by the first invocation which uses it, the stubs are then gone from sys.modules
+        module._initialize_sdk()
+    return module
@@ -0,0 +1,137 @@
+import os
+from pathlib import Path
+import random
+import string
+import sys
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "admin"))
+
+from firebase_controller.snapshot import Snapshot
+
+
+def _random_id(rng: random.Random, length: int = 28) -> str:
+    return "".join(rng.choices(string.ascii_letters + string.digits, k=length))
+
+
+def _user(user_id: str, first_name: str, last_name: str, connected_tokens: list[str]) -> dict:
+    return {
+        "avatar": "🐶",
+        "changePassword": False,
+        "creationDate": "2025-08-01T00:00:00.000",
+        "email": f"{first_name}.{last_name}@example.com".lower(),
+        "firstName": first_name,
+        "id": user_id,
+        "lastName": last_name,
+        "tokens": {"connected": {token: True for token in connected_tokens}},
+    }
+
+
+def generate_database(
+    classes: int = 10,
+    students_per_class: int = 25,
+    questions_per_teacher: int = 20,
+    messages_per_question: int = 20,
+    photos_per_question: int = 0,
+    seed: int = 42,
+) -> dict:
+    """
+    Generates a synthetic "v0_1_0" tree with the same shape as the production database. Every student answers every
+    question of their teacher and each answer holds [messages_per_question] text messages and [photos_per_question]
+    photos sent by the student, whose text is the storage path of the photo (e.g. "/{student_id}/{hash}.jpg").
+    """
+    rng = random.Random(seed)
+    first_timestamp = 1_700_000_000_000_000
+
+    tree = {"answers": {}, "questions": {}, "tokens": {"existing": {}}, "users": {}}
+    for class_index in range(classes):
+        token = "".join(rng.choices(string.ascii_uppercase + string.digits, k=6))
+        teacher_id = _random_id(rng)
+        student_ids = [_random_id(rng) for _ in range(students_per_class)]
+
+        tree["users"][teacher_id] = _user(teacher_id, f"Prénom{class_index}", f"Nom{class_index}", [])
+        tree["tokens"]["existing"][token] = True
+        tree["tokens"][token] = {
+            "connectedUsers": {student_id: True for student_id in student_ids},
+            "metadata": {"createdBy": teacher_id},
+        }
+
+        questions = {}
+        for _ in range(questions_per_teacher):
+            question_id = _random_id(rng, length=21)
+            questions[question_id] = {
+                "canBeDeleted": False,
+                "creationTimeStamp": first_timestamp,
+                "defaultTarget": 0,
+                "id": question_id,
+                "section": rng.randrange(6),
+                "text": f"Question {question_id}",
+            }
+        tree["questions"][teacher_id] = questions
+
+        tree["answers"][token] = {}
+        for student_index, student_id in enumerate(student_ids):
+            tree["users"][student_id] = _user(student_id, f"Élève{student_index}", f"Classe{class_index}", [token])
+
+            answers = {}
+            for question_id in questions:
+                discussion = {}
+                for _ in range(messages_per_question):
+                    message_id = _random_id(rng, length=36)
+                    creator_id = student_id if rng.random() < 0.6 else teacher_id
+                    discussion[message_id] = {
+                        "creationTimeStamp": first_timestamp + rng.randrange(365 * 24 * 3600 * 1_000_000),
+                        "creatorId": creator_id,
+                        "id": message_id,
+                        "isPhotoUrl": False,
+                        "studentId": student_id,
+                        "text": f"Message {message_id}",
+                    }
+                for _ in range(photos_per_question):
+                    message_id = _random_id(rng, length=36)
+                    discussion[message_id] = {
+                        "creationTimeStamp": first_timestamp + rng.randrange(365 * 24 * 3600 * 1_000_000),
+                        "creatorId": student_id,
+                        "id": message_id,
+                        "isPhotoUrl": True,
+                        "studentId": student_id,
+                        "text": f"/{student_id}/{rng.randrange(1 << 30)}.jpg",
+                    }
+                answers[question_id] = {
+                    "actionRequired": 1,
+                    "createdById": teacher_id,
+                    "discussion": discussion,
+                    "id": question_id,
+                    "isActive": True,
+                    "isValidated": False,
+                    "studentId": student_id,
+                }
+            tree["answers"][token][student_id] = answers
+    return tree
+
+
+def database_from_env() -> dict:
+    """Generates the database sized by the BENCHMARK_* environment variables, the defaults give 100 000 messages"""
+    return generate_database(
+        classes=int(os.getenv("BENCHMARK_CLASSES", "10")),
+        students_per_class=int(os.getenv("BENCHMARK_STUDENTS_PER_CLASS", "25")),
+        questions_per_teacher=int(os.getenv("BENCHMARK_QUESTIONS_PER_TEACHER", "20")),
+        messages_per_question=int(os.getenv("BENCHMARK_MESSAGES_PER_QUESTION", "20")),
+        photos_per_question=int(os.getenv("BENCHMARK_PHOTOS_PER_QUESTION", "0")),
+    )
+
+
+def photo_paths(tree: dict) -> list[str]:
+    """Storage paths, relative to the bucket, of all the photos posted in the discussions of [tree]"""
+    return [
+        message["text"].lstrip("/")
+        for students in tree["answers"].values()
+        for answers in students.values()
+        for answer in answers.values()
+        for message in answer.get("discussion", {}).values()
+        if message.get("isPhotoUrl")
+    ]
+
+
+def write_snapshot(tree: dict, temporary_folder: Path) -> None:
+    """Writes [tree] where FirebaseController expects its predownloaded database"""
+    Snapshot.write(temporary_folder / "firebase_export.sqlite", tree)